@@ -1,20 +1,109 @@
 import pyodbc
 import json
-import gzip
 import os
+import io
+import threading
+import hashlib
 from datetime import datetime
-from pathlib import Path
+from pathlib import PurePosixPath
 import logging
 from django.conf import settings
+from .storage import get_storage, storage_for_location
+from .backup_reader import BackupReader
+from .compression import DICTIONARY_FILE, GzipCodec, ZstdDictCodec, train_dictionary
 
 logger = logging.getLogger(__name__)
 
+
+class SpillBuffer:
+    """Write target that stays in memory until it grows past ``threshold`` bytes,
+    then spills everything to ``name`` in storage and continues writing there."""
+    
+    def __init__(self, storage, name, threshold):
+        self.storage = storage
+        self.name = name
+        self.threshold = threshold
+        self.buffer = io.BytesIO()
+        self.file = None
+    
+    @property
+    def spilled(self):
+        return self.file is not None
+    
+    def write(self, data):
+        if self.file is None and self.buffer.tell() + len(data) > self.threshold:
+            self.file = self.storage.open_write(self.name)
+            self.file.write(self.buffer.getvalue())
+            self.buffer = None
+        if self.file is not None:
+            return self.file.write(data)
+        return self.buffer.write(data)
+    
+    def getvalue(self):
+        return self.buffer.getvalue()
+    
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+    
+    def discard(self):
+        """Drop a spilled file without publishing it"""
+        if self.file is not None:
+            self.storage.discard(self.file, self.name)
+            self.file = None
+
+
+class SegmentWriter:
+    """Appends small tables into shared segment files, rolling over at ``segment_size``"""
+    
+    def __init__(self, storage, backup_dir, segment_size):
+        self.storage = storage
+        self.backup_dir = backup_dir
+        self.segment_size = segment_size
+        self.segment_number = 0
+        self.segment_name = None
+        self.file = None
+        self.offset = 0
+        self.total_size = 0
+    
+    def append(self, data):
+        """Append data to the current segment and return (segment_name, offset)"""
+        if self.file is None or (self.offset and self.offset + len(data) > self.segment_size):
+            self.roll()
+        offset = self.offset
+        self.file.write(data)
+        self.offset += len(data)
+        self.total_size += len(data)
+        return self.segment_name, offset
+    
+    def roll(self):
+        self.close()
+        self.segment_number += 1
+        self.segment_name = f"segment_{self.segment_number:04d}.dat"
+        self.file = self.storage.open_write(f"{self.backup_dir}/{self.segment_name}")
+        self.offset = 0
+    
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
 class MSSQLStreamBackup:
-    def __init__(self, server_config):
+    def __init__(self, server_config, storage=None):
         self.server_config = server_config
-        self.backup_path = Path(settings.BACKUP_ROOT) / server_config['name']
-        self.backup_path.mkdir(parents=True, exist_ok=True)
-        
+        self._storage = storage
+    
+    @property
+    def storage(self):
+        # Created lazily: connection tests and native backups never touch backup storage
+        if self._storage is None:
+            self._storage = get_storage()
+        return self._storage
+    
+    def write_json(self, name, data, **kwargs):
+        self.storage.write_bytes(name, json.dumps(data, **kwargs).encode('utf-8'))
+    
     def get_connection_string(self, database_name='master'):
         return (
             f"DRIVER={{ODBC Driver 17 for SQL Server}};"
@@ -25,14 +114,35 @@ class MSSQLStreamBackup:
             f"TrustServerCertificate=yes;"
         )
     
+    def connect(self, database_name='master', **kwargs):
+        """Open a pyodbc connection to the given database"""
+        return pyodbc.connect(self.get_connection_string(database_name), **kwargs)
+    
     def test_connection(self):
         """Test database connection"""
         try:
-            with pyodbc.connect(self.get_connection_string(), timeout=10):
+            with self.connect(timeout=10):
                 return True, "Connection successful"
         except Exception as e:
             return False, str(e)
     
+    def get_all_databases(self):
+        """Get all user databases from the SQL Server (excluding system databases)"""
+        try:
+            with self.connect(timeout=10) as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    SELECT name 
+                    FROM sys.databases 
+                    WHERE database_id > 4  -- Exclude system databases (master, tempdb, model, msdb)
+                    AND state = 0  -- Only online databases
+                    AND name NOT IN ('ReportServer', 'ReportServerTempDB')  -- Exclude common system databases
+                    ORDER BY name
+                """)
+                return [row.name for row in cursor.fetchall()]
+        except Exception as e:
+            raise Exception(f"Failed to retrieve databases: {str(e)}")
+    
     def get_database_tables(self, database_name):
         """Get all tables from the specified database"""
         query = """
@@ -42,16 +152,99 @@ class MSSQLStreamBackup:
         ORDER BY TABLE_SCHEMA, TABLE_NAME
         """
         
-        with pyodbc.connect(self.get_connection_string(database_name)) as conn:
+        with self.connect(database_name) as conn:
             cursor = conn.cursor()
             cursor.execute(query)
             return [(row.TABLE_SCHEMA, row.TABLE_NAME) for row in cursor.fetchall()]
 
-    def stream_table_data(self, database_name, schema_name, table_name, output_file):
-        """Stream table data to compressed JSON file"""
+    @staticmethod
+    def serialize_row(columns, row):
+        """Convert a pyodbc row to a JSON-serializable dict"""
+        row_dict = {}
+        for i, value in enumerate(row):
+            if isinstance(value, datetime):
+                row_dict[columns[i]] = value.isoformat()
+            elif value is None:
+                row_dict[columns[i]] = None
+            else:
+                row_dict[columns[i]] = str(value)
+        return row_dict
+    
+    @staticmethod
+    def get_index_file(output_file):
+        """Sidecar index name for a table data file"""
+        output_file = PurePosixPath(output_file)
+        base_name = output_file.name
+        for extension in ('.json.gz', '.json.zst'):
+            if base_name.endswith(extension):
+                base_name = base_name[:-len(extension)]
+                break
+        return output_file.with_name(base_name + '.index.json')
+    
+    def write_table_blocks(self, cursor, columns, f, block_rows, codec=None):
+        """Write rows from the cursor as independently compressed NDJSON blocks.
+        
+        With the default gzip codec each block is a complete gzip member, so
+        the file as a whole is still a valid gzip stream (``.json.gz``), but
+        any block can be decompressed on its own given its offset and length.
+        zstd blocks are zstd frames; their file (``.json.zst``) decompresses
+        with ``zstd -d -D compression.dict`` but not with gunzip. Each block
+        records the SHA-256 of its uncompressed NDJSON so backups can be
+        compared without decompressing them. Returns (blocks, row_count,
+        table_hash), where table_hash covers the table's whole NDJSON
+        stream and so doesn't depend on block size or codec.
+        """
+        codec = codec or GzipCodec()
+        table_hash = hashlib.sha256()
+        blocks = []
+        offset = 0
+        row_count = 0
+        block_start = 0
+        lines = []
+        chunk_size = 1000
+        
+        def flush_block():
+            nonlocal offset
+            payload = ('\n'.join(lines) + '\n').encode('utf-8')
+            table_hash.update(payload)
+            data = codec.compress(payload)
+            f.write(data)
+            block = {
+                'row_start': block_start,
+                'rows': len(lines),
+                'offset': offset,
+                'length': len(data),
+                'sha256': hashlib.sha256(payload).hexdigest(),
+            }
+            if codec.name != 'gzip':
+                block['codec'] = codec.name
+            blocks.append(block)
+            offset += len(data)
+            lines.clear()
+        
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            
+            for row in rows:
+                lines.append(json.dumps(self.serialize_row(columns, row)))
+                row_count += 1
+                if len(lines) >= block_rows:
+                    flush_block()
+                    block_start = row_count
+        
+        if lines:
+            flush_block()
+        
+        return blocks, row_count, table_hash.hexdigest()
+    
+    def export_table(self, database_name, schema_name, table_name, f, block_rows=None, codec=None):
+        """Stream a table's rows into f as gzip blocks and return the table index"""
         full_table_name = f"[{schema_name}].[{table_name}]"
+        block_rows = block_rows or getattr(settings, 'BACKUP_BLOCK_ROWS', 10000)
         
-        with pyodbc.connect(self.get_connection_string(database_name)) as conn:
+        with self.connect(database_name) as conn:
             cursor = conn.cursor()
             
             # Get column information
@@ -60,72 +253,164 @@ class MSSQLStreamBackup:
             
             # Stream data in chunks
             cursor.execute(f"SELECT * FROM {full_table_name}")
-            
-            with gzip.open(output_file, 'wt', encoding='utf-8') as f:
-                row_count = 0
-                chunk_size = 1000
-                first_chunk = True
-                
-                # Write opening metadata
-                f.write('{"database":"' + database_name + '","schema":"' + schema_name + 
-                       '","table":"' + table_name + '","columns":' + json.dumps(columns) + 
-                       ',"backup_timestamp":"' + datetime.now().isoformat() + '","data":[')
-                
-                while True:
-                    rows = cursor.fetchmany(chunk_size)
-                    if not rows:
-                        break
-                    
-                    for row in rows:
-                        if not first_chunk or row_count > 0:
-                            f.write(',')
-                        
-                        row_dict = {}
-                        for i, value in enumerate(row):
-                            if isinstance(value, datetime):
-                                row_dict[columns[i]] = value.isoformat()
-                            elif value is None:
-                                row_dict[columns[i]] = None
-                            else:
-                                row_dict[columns[i]] = str(value)
-                        
-                        f.write(json.dumps(row_dict))
-                        row_count += 1
-                    
-                    first_chunk = False
-                
-                f.write(']}')
-                logger.info(f"Backed up {row_count} rows from {full_table_name}")
-                return row_count
-
-    def backup_database(self, database_name, progress_callback=None, include_schema=True):
-        """Enhanced backup with better error handling and schema support"""
+            blocks, row_count, table_hash = self.write_table_blocks(cursor, columns, f, block_rows, codec)
+        
+        logger.info(f"Backed up {row_count} rows from {full_table_name} in {len(blocks)} blocks")
+        return {
+            'database': database_name,
+            'schema': schema_name,
+            'table': table_name,
+            'columns': columns,
+            'backup_timestamp': datetime.now().isoformat(),
+            'row_count': row_count,
+            'block_rows': block_rows,
+            'size': sum(block['length'] for block in blocks),
+            'codec': codec.name if codec else 'gzip',
+            'sha256': table_hash,
+            'blocks': blocks,
+        }
+    
+    def write_index_file(self, output_file, index):
+        """Write the sidecar index for a dedicated table file and return its manifest entry"""
+        index_file = self.get_index_file(output_file)
+        self.write_json(str(index_file), index)
+        
+        return {
+            'schema': index['schema'],
+            'table': index['table'],
+            'file': PurePosixPath(output_file).name,
+            'index': index_file.name,
+            'rows': index['row_count'],
+            'size': index['size'],
+            'codec': index['codec'],
+            'sha256': index['sha256'],
+        }
+    
+    def stream_table_data(self, database_name, schema_name, table_name, output_file, block_rows=None, codec=None):
+        """Stream table data to a block-compressed NDJSON file with a sidecar index"""
+        f = self.storage.open_write(output_file)
+        try:
+            index = self.export_table(database_name, schema_name, table_name, f, block_rows, codec)
+        except Exception:
+            # Don't leave a truncated table file behind
+            self.storage.discard(f, output_file)
+            raise
+        f.close()
+        
+        return self.write_index_file(output_file, index)
+    
+    def pack_table_data(self, database_name, schema_name, table_name, output_file, segments, block_rows=None, codec=None):
+        """Append a small table to a shared segment, or give it its own file if it
+        grows past BACKUP_PACK_THRESHOLD"""
+        threshold = getattr(settings, 'BACKUP_PACK_THRESHOLD', 1024 * 1024)
+        buffer = SpillBuffer(self.storage, output_file, threshold)
+        try:
+            index = self.export_table(database_name, schema_name, table_name, buffer, block_rows, codec)
+        except Exception:
+            buffer.discard()
+            raise
+        buffer.close()
+        
+        if buffer.spilled:
+            return self.write_index_file(output_file, index)
+        
+        segment_name, offset = segments.append(buffer.getvalue())
+        return {
+            'schema': schema_name,
+            'table': table_name,
+            'segment': segment_name,
+            'offset': offset,
+            'rows': index['row_count'],
+            'size': index['size'],
+            'codec': index['codec'],
+            'sha256': index['sha256'],
+            'inline_index': index,
+        }
+    
+    def prepare_dictionary(self, backup_dir, dictionary_source):
+        """Train a zstd dictionary from an earlier backup and store it in backup_dir.
+        
+        Returns (codec, small_tables, manifest_info), or None if no dictionary
+        could be trained.
+        """
+        try:
+            reader = BackupReader(storage_for_location(dictionary_source))
+            trained = train_dictionary(reader, getattr(settings, 'BACKUP_PACK_THRESHOLD', 1024 * 1024))
+        except Exception as e:
+            logger.warning(f"Could not train compression dictionary from {dictionary_source}: {str(e)}")
+            return None
+        if trained is None:
+            return None
+        
+        dictionary_data, small_tables, benchmark = trained
+        self.storage.write_bytes(f"{backup_dir}/{DICTIONARY_FILE}", dictionary_data)
+        codec = ZstdDictCodec(dictionary_data)
+        return codec, small_tables, {
+            'file': DICTIONARY_FILE,
+            'dict_id': codec.dictionary.dict_id(),
+            'size': len(dictionary_data),
+            'trained_from': dictionary_source,
+            'benchmark': benchmark,
+        }
+    
+    def backup_database(self, database_name, progress_callback=None, include_schema=True, layout=None,
+                        dictionary_source=None):
+        """Enhanced backup with better error handling and schema support.
+        
+        With the 'packed' layout, tables smaller than BACKUP_PACK_THRESHOLD are
+        appended to shared segment files and indexed in the manifest, while
+        larger tables keep their own file and sidecar index.
+        
+        If BACKUP_ZSTD_DICTIONARY is enabled and ``dictionary_source`` names an
+        earlier backup of the same database, a zstd dictionary is trained from
+        it and used for the tables that were small in that backup.
+        """
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        backup_dir = self.backup_path / f"{database_name}_{timestamp}"
-        backup_dir.mkdir(exist_ok=True)
+        backup_dir = f"{self.server_config['name']}/{database_name}_{timestamp}"
+        layout = layout or getattr(settings, 'BACKUP_LAYOUT', 'packed')
+        segments = SegmentWriter(self.storage, backup_dir, getattr(settings, 'BACKUP_SEGMENT_SIZE', 256 * 1024 * 1024))
+        gzip_codec = GzipCodec()
+        dictionary_codec, small_tables, dictionary_info = None, set(), None
         
         try:
             # Backup schema information if requested
             if include_schema:
                 self.backup_schema(database_name, backup_dir)
             
+            if dictionary_source and getattr(settings, 'BACKUP_ZSTD_DICTIONARY', False):
+                if progress_callback:
+                    progress_callback("Training compression dictionary from previous backup")
+                prepared = self.prepare_dictionary(backup_dir, dictionary_source)
+                if prepared:
+                    dictionary_codec, small_tables, dictionary_info = prepared
+            
             tables = self.get_database_tables(database_name)
+            table_entries = []
+            failed_tables = []
             total_size = 0
             
             for i, (schema_name, table_name) in enumerate(tables):
                 try:
-                    output_file = backup_dir / f"{schema_name}_{table_name}.json.gz"
+                    codec = dictionary_codec if (schema_name, table_name) in small_tables else gzip_codec
+                    output_file = f"{backup_dir}/{schema_name}_{table_name}.json{codec.file_extension}"
                     if progress_callback:
                         progress_callback(f"Backing up {schema_name}.{table_name} ({i+1}/{len(tables)})")
                     
-                    row_count = self.stream_table_data(database_name, schema_name, table_name, output_file)
-                    total_size += output_file.stat().st_size
+                    if layout == 'packed':
+                        entry = self.pack_table_data(database_name, schema_name, table_name, output_file, segments, codec=codec)
+                    else:
+                        entry = self.stream_table_data(database_name, schema_name, table_name, output_file, codec=codec)
+                    total_size += entry['size']
+                    table_entries.append(entry)
                     
                 except Exception as e:
                     logger.warning(f"Failed to backup table {schema_name}.{table_name}: {str(e)}")
+                    failed_tables.append({'schema': schema_name, 'table': table_name, 'error': str(e)})
                     # Continue with other tables
                     continue
             
+            segments.close()
+            
             # Create backup manifest with more details
             manifest = {
                 'database': database_name,
@@ -134,23 +419,33 @@ class MSSQLStreamBackup:
                 'tables_count': len(tables),
                 'total_size': total_size,
                 'compression': 'gzip',
-                'tables': [{'schema': schema, 'table': table} for schema, table in tables]
+                'table_format': 'gzip_blocks',
+                'layout': layout,
+                'segments_count': segments.segment_number,
+                'block_rows': getattr(settings, 'BACKUP_BLOCK_ROWS', 10000),
+                'tables': table_entries,
+                'failed_tables': failed_tables,
+                'compression_stats': {'gzip': gzip_codec.get_stats()},
             }
+            if dictionary_codec:
+                manifest['compression_dictionary'] = dictionary_info
+                manifest['compression_stats']['zstd_dictionary'] = dictionary_codec.get_stats()
             
-            with open(backup_dir / "backup_manifest.json", 'w') as f:
-                json.dump(manifest, f, indent=2)
+            self.write_json(f"{backup_dir}/backup_manifest.json", manifest, indent=2)
             
-            return str(backup_dir), total_size
+            return self.storage.location(backup_dir), total_size
             
         except Exception as e:
             logger.error(f"Backup failed: {str(e)}")
             raise
+        finally:
+            segments.close()
 
     def backup_schema(self, database_name, backup_dir):
         """Backup database schema information"""
         schema_info = {}
         
-        with pyodbc.connect(self.get_connection_string(database_name)) as conn:
+        with self.connect(database_name) as conn:
             cursor = conn.cursor()
             
             # Get table schemas
@@ -174,23 +469,167 @@ class MSSQLStreamBackup:
                     'max_length': row.CHARACTER_MAXIMUM_LENGTH
                 })
         
-        with open(backup_dir / "schema.json", 'w') as f:
-            json.dump(schema_info, f, indent=2)
+        self.write_json(f"{backup_dir}/schema.json", schema_info, indent=2)
 
 
-def get_all_databases(self):
-    """Get all user databases from the SQL Server (excluding system databases)"""
-    try:
-        with pyodbc.connect(self.get_connection_string(), timeout=10) as conn:
+class MSSQLNativeBackup(MSSQLStreamBackup):
+    """Backup using SQL Server's native BACKUP DATABASE command.
+    
+    The .bak files are written by SQL Server itself, so ``native_backup_dir``
+    is a path on the SQL Server host rather than on this machine.
+    """
+    
+    PROGRESS_QUERY = """
+        SELECT percent_complete
+        FROM sys.dm_exec_requests
+        WHERE session_id = ? AND command LIKE 'BACKUP%'
+    """
+    
+    BACKUP_SIZE_QUERY = """
+        SELECT TOP 1 bs.compressed_backup_size, bs.backup_size
+        FROM msdb.dbo.backupset bs
+        JOIN msdb.dbo.backupmediafamily mf ON mf.media_set_id = bs.media_set_id
+        WHERE bs.database_name = ? AND bs.type = 'D' AND mf.physical_device_name = ?
+        ORDER BY bs.backup_finish_date DESC
+    """
+    
+    def __init__(self, server_config, poll_interval=None):
+        super().__init__(server_config, storage=None)
+        self.poll_interval = poll_interval or getattr(settings, 'NATIVE_BACKUP_POLL_INTERVAL', 5)
+    
+    @staticmethod
+    def quote_name(name):
+        return '[' + name.replace(']', ']]') + ']'
+    
+    @staticmethod
+    def quote_string(value):
+        return "N'" + value.replace("'", "''") + "'"
+    
+    @staticmethod
+    def join_server_path(directory, file_name):
+        """Join a path on the SQL Server host, which may be Windows or Linux"""
+        separator = '\\' if '\\' in directory or directory[1:2] == ':' else '/'
+        return directory.rstrip('\\/') + separator + file_name
+    
+    def get_stripe_files(self, database_name, timestamp):
+        """Build the list of .bak file paths the backup is striped across"""
+        backup_dir = self.server_config.get('native_backup_dir')
+        if not backup_dir:
+            raise ValueError("native_backup_dir must be set for native backups")
+        
+        stripe_count = max(1, int(self.server_config.get('stripe_count') or 1))
+        base_name = f"{database_name}_{timestamp}"
+        
+        if stripe_count == 1:
+            return [self.join_server_path(backup_dir, f"{base_name}.bak")]
+        
+        return [
+            self.join_server_path(backup_dir, f"{base_name}_{i}of{stripe_count}.bak")
+            for i in range(1, stripe_count + 1)
+        ]
+    
+    def build_backup_sql(self, database_name, backup_files):
+        """Generate the BACKUP DATABASE statement for the given stripe files"""
+        disks = ', '.join(f"DISK = {self.quote_string(path)}" for path in backup_files)
+        options = ['COMPRESSION', 'CHECKSUM', 'INIT', 'STATS = 5']
+        
+        max_transfer_size = self.server_config.get('max_transfer_size')
+        if max_transfer_size:
+            options.append(f"MAXTRANSFERSIZE = {int(max_transfer_size)}")
+        
+        buffer_count = self.server_config.get('buffer_count')
+        if buffer_count:
+            options.append(f"BUFFERCOUNT = {int(buffer_count)}")
+        
+        return (
+            f"BACKUP DATABASE {self.quote_name(database_name)} "
+            f"TO {disks} "
+            f"WITH {', '.join(options)}"
+        )
+    
+    def run_backup_statement(self, sql, session_ready, result):
+        """Execute the BACKUP statement; runs in a worker thread"""
+        try:
+            with self.connect(autocommit=True) as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT @@SPID")
+                result['session_id'] = cursor.fetchone()[0]
+                session_ready.set()
+                
+                cursor.execute(sql)
+                # BACKUP reports progress as informational result sets;
+                # they must be drained for the statement to finish.
+                while cursor.nextset():
+                    pass
+        except Exception as e:
+            result['error'] = e
+        finally:
+            session_ready.set()
+    
+    def poll_progress(self, session_id, backup_thread, progress_callback=None):
+        """Poll sys.dm_exec_requests until the backup thread finishes"""
+        last_percent = None
+        with self.connect(autocommit=True) as conn:
             cursor = conn.cursor()
-            cursor.execute("""
-                SELECT name 
-                FROM sys.databases 
-                WHERE database_id > 4  -- Exclude system databases (master, tempdb, model, msdb)
-                AND state = 0  -- Only online databases
-                AND name NOT IN ('ReportServer', 'ReportServerTempDB')  -- Exclude common system databases
-                ORDER BY name
-            """)
-            return [row.name for row in cursor.fetchall()]
-    except Exception as e:
-        raise Exception(f"Failed to retrieve databases: {str(e)}")
\ No newline at end of file
+            while backup_thread.is_alive():
+                cursor.execute(self.PROGRESS_QUERY, session_id)
+                row = cursor.fetchone()
+                if row is not None:
+                    percent = round(float(row[0]), 1)
+                    if percent != last_percent and progress_callback:
+                        progress_callback(f"Native backup {percent}% complete")
+                    last_percent = percent
+                backup_thread.join(self.poll_interval)
+        return last_percent
+    
+    def get_backup_size(self, database_name, backup_file):
+        """Size recorded in msdb for the full backup written to ``backup_file``"""
+        with self.connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute(self.BACKUP_SIZE_QUERY, database_name, backup_file)
+            row = cursor.fetchone()
+            if row is None:
+                return 0
+            return int(row[0] or row[1] or 0)
+    
+    def backup_database(self, database_name, progress_callback=None, include_schema=True, **kwargs):
+        """Run BACKUP DATABASE ... WITH COMPRESSION, CHECKSUM and wait for it to finish"""
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        backup_files = self.get_stripe_files(database_name, timestamp)
+        sql = self.build_backup_sql(database_name, backup_files)
+        logger.info(f"Starting native backup of {database_name}: {sql}")
+        
+        session_ready = threading.Event()
+        result = {}
+        backup_thread = threading.Thread(
+            target=self.run_backup_statement,
+            args=(sql, session_ready, result),
+            daemon=True,
+        )
+        backup_thread.start()
+        session_ready.wait()
+        
+        if 'session_id' in result:
+            try:
+                self.poll_progress(result['session_id'], backup_thread, progress_callback)
+            except Exception as e:
+                logger.warning(f"Progress polling failed for {database_name}: {str(e)}")
+        backup_thread.join()
+        
+        if 'error' in result:
+            logger.error(f"Native backup failed: {str(result['error'])}")
+            raise result['error']
+        
+        if progress_callback:
+            progress_callback(f"Native backup of {database_name} written to {len(backup_files)} file(s)")
+        
+        # Look the backup up by its first file so another job's backup isn't picked up
+        total_size = self.get_backup_size(database_name, backup_files[0])
+        return ';'.join(backup_files), total_size
+
+
+def get_backup_engine(server_config):
+    """Return the backup engine for the server's configured backup mode"""
+    if server_config.get('backup_mode') == 'native':
+        return MSSQLNativeBackup(server_config)
+    return MSSQLStreamBackup(server_config)
@@ -0,0 +1,270 @@
+import json
+import gzip
+import bisect
+import threading
+import logging
+from contextlib import closing
+from itertools import islice
+from .storage import BackupStorage, storage_for_location
+from .compression import GzipCodec, ZstdDictCodec
+
+logger = logging.getLogger(__name__)
+
+
+class LegacyTableStream:
+    """Incremental parser for legacy single-stream table files.
+    
+    Those files are a single JSON object whose "data" array holds every row,
+    so json.load() would need the whole table in memory. This walks the
+    object with JSONDecoder.raw_decode() over a buffered text stream instead,
+    holding one row and one read chunk at a time. Iterating yields
+    (key, value) for each field, and ('data', row) for each row.
+    """
+    
+    def __init__(self, f, chunk_size=64 * 1024):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.pos = 0
+    
+    def __iter__(self):
+        self._expect('{')
+        if self._peek() == '}':
+            return
+        while True:
+            key = self._value()
+            self._expect(':')
+            if key != 'data':
+                yield key, self._value()
+            else:
+                self._expect('[')
+                if self._peek() == ']':
+                    self.pos += 1
+                else:
+                    while True:
+                        yield key, self._value()
+                        if self._expect(',]') == ']':
+                            break
+            if self._expect(',}') == '}':
+                return
+    
+    def _fill(self):
+        """Read another chunk, dropping what has been consumed; False at end of file"""
+        chunk = self.f.read(self.chunk_size)
+        if not chunk:
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+    
+    def _peek(self):
+        """Skip whitespace and return the next character without consuming it"""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in ' \t\r\n':
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                raise ValueError("Unexpected end of legacy table file")
+    
+    def _expect(self, chars):
+        char = self._peek()
+        if char not in chars:
+            raise ValueError(f"Malformed legacy table file: expected one of {chars!r}, found {char!r}")
+        self.pos += 1
+        return char
+    
+    def _value(self):
+        """Decode the next JSON value, reading more input until it is complete"""
+        self._peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+                continue
+            # A number ending the buffer may carry on in the next chunk
+            if end == len(self.buffer) and self._fill():
+                continue
+            self.pos = end
+            return value
+
+
+class BackupReader:
+    """Random access to the table files of a streaming JSON backup.
+    
+    Table files written as independently gzipped blocks have a sidecar
+    index, so a row range only needs the blocks that contain it. Small tables
+    in the packed layout live inside a shared segment file and are indexed in
+    the manifest instead. Older single-stream files are still readable, but
+    are parsed incrementally from the start.
+    """
+    
+    def __init__(self, backup_dir):
+        """``backup_dir`` is a location returned by the backup engine, or a
+        storage already rooted at the backup directory."""
+        if isinstance(backup_dir, BackupStorage):
+            self.storage = backup_dir
+        else:
+            self.storage = storage_for_location(str(backup_dir))
+        self._manifest = None
+        self._entries = None
+        self._indexes = {}
+        self._legacy_columns = {}
+        self._legacy_row_counts = {}
+        self._dictionary = None
+        # zstd decompressors can't be shared between threads, so each thread
+        # reading from this backup gets its own codecs
+        self._local = threading.local()
+    
+    def get_manifest(self):
+        """Load the backup manifest"""
+        if self._manifest is None:
+            self._manifest = json.loads(self.storage.read_bytes("backup_manifest.json"))
+        return self._manifest
+    
+    def get_tables(self):
+        """Table entries listed in the manifest"""
+        return self.get_manifest().get('tables', [])
+    
+    def get_table_entry(self, schema_name, table_name):
+        if self._entries is None:
+            self._entries = {(entry['schema'], entry['table']): entry for entry in self.get_tables()}
+        try:
+            return self._entries[(schema_name, table_name)]
+        except KeyError:
+            raise KeyError(f"Table {schema_name}.{table_name} not found in backup")
+    
+    def get_table_index(self, schema_name, table_name):
+        """Load the block index for a table, or None for legacy single-stream files"""
+        key = (schema_name, table_name)
+        if key not in self._indexes:
+            entry = self.get_table_entry(schema_name, table_name)
+            index = entry.get('inline_index')
+            if index is None and entry.get('index'):
+                index = json.loads(self.storage.read_bytes(entry['index']))
+            self._indexes[key] = index
+        return self._indexes[key]
+    
+    def get_columns(self, schema_name, table_name):
+        index = self.get_table_index(schema_name, table_name)
+        if index is not None:
+            return index['columns']
+        
+        key = (schema_name, table_name)
+        if key not in self._legacy_columns:
+            # Legacy files write the columns ahead of the data, so this only reads the header
+            with closing(self._iter_legacy_table(schema_name, table_name)) as items:
+                self._legacy_columns[key] = next((value for name, value in items if name == 'columns'), [])
+        return self._legacy_columns[key]
+    
+    def get_row_count(self, schema_name, table_name):
+        """Rows in a table; for legacy files without a count in the manifest this reads the whole file"""
+        index = self.get_table_index(schema_name, table_name)
+        if index is not None:
+            return index['row_count']
+        
+        key = (schema_name, table_name)
+        if key not in self._legacy_row_counts:
+            rows = self.get_table_entry(schema_name, table_name).get('rows')
+            if rows is None:
+                rows = sum(1 for _ in self._iter_legacy_rows(schema_name, table_name))
+            self._legacy_row_counts[key] = rows
+        return self._legacy_row_counts[key]
+    
+    def exists(self):
+        return self.storage.exists("backup_manifest.json")
+    
+    def get_table_path(self, schema_name, table_name):
+        """Name of the file holding the table's data, and the table's offset within it"""
+        entry = self.get_table_entry(schema_name, table_name)
+        if entry.get('segment'):
+            return entry['segment'], entry['offset']
+        return entry.get('file', f"{schema_name}_{table_name}.json.gz"), 0
+    
+    def get_codec(self, name):
+        """Codec for decoding blocks; zstd blocks use the dictionary stored with the backup"""
+        codecs = getattr(self._local, 'codecs', None)
+        if codecs is None:
+            codecs = self._local.codecs = {'gzip': GzipCodec()}
+        if name not in codecs:
+            if name != 'zstd':
+                raise ValueError(f"Unknown block codec: {name}")
+            if self._dictionary is None:
+                dictionary = self.get_manifest()['compression_dictionary']
+                self._dictionary = self.storage.read_bytes(dictionary['file'])
+            codecs[name] = ZstdDictCodec(self._dictionary)
+        return codecs[name]
+    
+    def read_block_data(self, f, block, base_offset=0):
+        """Decompress a single block and return its raw NDJSON bytes"""
+        f.seek(base_offset + block['offset'])
+        codec = self.get_codec(block.get('codec', 'gzip'))
+        return codec.decompress(f.read(block['length']))
+    
+    def read_block(self, f, block, base_offset=0):
+        """Decompress a single block and return its rows"""
+        data = self.read_block_data(f, block, base_offset)
+        return [json.loads(line) for line in data.decode('utf-8').splitlines() if line]
+    
+    def iter_rows(self, schema_name, table_name, start=0, stop=None):
+        """Yield rows in [start, stop) without decoding the blocks before start"""
+        index = self.get_table_index(schema_name, table_name)
+        if index is None:
+            yield from self._iter_legacy_rows(schema_name, table_name, start, stop)
+            return
+        
+        blocks = index['blocks']
+        if stop is None:
+            stop = index['row_count']
+        if start >= stop or not blocks:
+            return
+        
+        # Find the block containing the first requested row
+        row_starts = [block['row_start'] for block in blocks]
+        first = max(bisect.bisect_right(row_starts, start) - 1, 0)
+        
+        path, base_offset = self.get_table_path(schema_name, table_name)
+        with self.storage.open_read(path) as f:
+            for block in blocks[first:]:
+                if block['row_start'] >= stop:
+                    break
+                rows = self.read_block(f, block, base_offset)
+                lo = max(start - block['row_start'], 0)
+                hi = min(stop - block['row_start'], len(rows))
+                yield from rows[lo:hi]
+    
+    def read_rows(self, schema_name, table_name, start=0, count=100):
+        """Return a list of up to ``count`` rows starting at row ``start``"""
+        return list(self.iter_rows(schema_name, table_name, start, start + count))
+    
+    def verify(self):
+        """Decode every table and check its row count against the index.
+        
+        Returns a list of (schema, table, error) tuples; empty if the backup is intact.
+        """
+        problems = []
+        for entry in self.get_tables():
+            schema_name, table_name = entry['schema'], entry['table']
+            try:
+                decoded = sum(1 for _ in self.iter_rows(schema_name, table_name))
+                expected = entry.get('rows')
+                if expected is None:
+                    expected = self.get_row_count(schema_name, table_name)
+                if decoded != expected:
+                    problems.append((schema_name, table_name, f"expected {expected} rows, decoded {decoded}"))
+            except Exception as e:
+                problems.append((schema_name, table_name, str(e)))
+        return problems
+    
+    def _iter_legacy_table(self, schema_name, table_name):
+        path, _ = self.get_table_path(schema_name, table_name)
+        with self.storage.open_read(path) as raw, gzip.open(raw, 'rt', encoding='utf-8') as f:
+            yield from LegacyTableStream(f)
+    
+    def _iter_legacy_rows(self, schema_name, table_name, start=0, stop=None):
+        """Rows in [start, stop) of a legacy file, closing it as soon as stop is reached"""
+        with closing(self._iter_legacy_table(schema_name, table_name)) as items:
+            yield from islice((value for name, value in items if name == 'data'), start, stop)
@@ -0,0 +1,114 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+from .models import BulkOperationResult, SQLServer
+from .discovery import check_server_health, discover_databases
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def get_bulk_concurrency():
+    return getattr(settings, 'BULK_OPERATION_CONCURRENCY', 16)
+
+
+def get_bulk_servers():
+    """Servers a bulk operation runs against"""
+    return SQLServer.objects.filter(is_active=True).order_by('name')
+
+
+def backup_server(server, operation):
+    from .tasks import queue_server_backup
+    
+    job_ids = queue_server_backup(server, bulk_operation=operation)
+    return True, f"{len(job_ids)} databases queued", {'job_ids': job_ids}
+
+
+def test_server(server, operation):
+    health = check_server_health(server)
+    return health['success'], health['message'], {}
+
+
+def refresh_server_databases(server, operation):
+    """Re-query the server's database list and compare it with the databases selected for backup"""
+    databases = discover_databases(server.get_server_config(), refresh=True)
+    selected = server.get_databases()
+    unselected = [name for name in databases if name not in selected]
+    missing = [name for name in selected if name not in databases]
+    
+    message = f"Found {len(databases)} databases"
+    if unselected:
+        message += f", {len(unselected)} not selected for backup"
+    if missing:
+        message += f"; selected but missing: {', '.join(missing)}"
+    return True, message, {'databases': databases, 'unselected': unselected, 'missing': missing}
+
+
+# action -> handler(server, operation) returning (success, message, details)
+BULK_ACTIONS = {
+    'backup': backup_server,
+    'test': test_server,
+    'refresh_databases': refresh_server_databases,
+}
+
+
+def run_bulk_operation(operation):
+    """Run an operation's action on every active server, up to operation.concurrency at a time.
+    
+    Servers are handled by a thread pool; each outcome is recorded as soon as
+    it arrives, so the progress view can follow along. A failure on one
+    server is recorded and doesn't stop the others.
+    """
+    handler = BULK_ACTIONS[operation.action]
+    servers = list(get_bulk_servers())
+    
+    operation.status = 'running'
+    operation.started_at = timezone.now()
+    operation.heartbeat_at = operation.started_at
+    operation.total_servers = len(servers)
+    operation.save(update_fields=['status', 'started_at', 'heartbeat_at', 'total_servers'])
+    
+    def run(server):
+        try:
+            return handler(server, operation)
+        except Exception as e:
+            logger.warning(f"Bulk {operation.action} failed on {server.name}: {str(e)}")
+            return False, str(e), {}
+        finally:
+            # Pool threads get their own database connection; don't leak it
+            connection.close()
+    
+    try:
+        if servers:
+            with ThreadPoolExecutor(max_workers=min(max(operation.concurrency, 1), len(servers))) as executor:
+                futures = {executor.submit(run, server): server for server in servers}
+                for future in as_completed(futures):
+                    success, message, details = future.result()
+                    BulkOperationResult.objects.create(
+                        operation=operation,
+                        server=futures[future],
+                        success=success,
+                        message=message,
+                        details=details,
+                    )
+                    operation.processed_servers += 1
+                    if not success:
+                        operation.failed_servers += 1
+                    operation.save(update_fields=['processed_servers', 'failed_servers'])
+    except Exception as e:
+        logger.error(f"Bulk operation {operation.id} failed: {str(e)}")
+        operation.status = 'failed'
+        operation.error_message = str(e)
+        operation.completed_at = timezone.now()
+        operation.save(update_fields=['status', 'error_message', 'completed_at'])
+        raise
+    
+    operation.status = 'completed'
+    operation.completed_at = timezone.now()
+    operation.save(update_fields=['status', 'completed_at'])
+    logger.info(
+        f"Bulk {operation.action} finished: {operation.processed_servers - operation.failed_servers} of "
+        f"{operation.total_servers} servers succeeded"
+    )
+    return operation
@@ -0,0 +1,171 @@
+from django.conf import settings
+import gzip
+import json
+import time
+import logging
+
+try:
+    import zstandard
+except ImportError:  # Optional: only needed for dictionary compression
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+DICTIONARY_FILE = "compression.dict"
+
+
+class Codec:
+    """Compresses table blocks, keeping totals of bytes in and out and time spent.
+    
+    Subclasses set ``name`` (recorded with each block) and ``file_extension``
+    and implement _compress() and decompress().
+    """
+    
+    name = None
+    file_extension = None
+    
+    def __init__(self):
+        self.raw_bytes = 0
+        self.compressed_bytes = 0
+        self.seconds = 0.0
+    
+    def compress(self, data):
+        started = time.perf_counter()
+        compressed = self._compress(data)
+        self.seconds += time.perf_counter() - started
+        self.raw_bytes += len(data)
+        self.compressed_bytes += len(compressed)
+        return compressed
+    
+    def _compress(self, data):
+        raise NotImplementedError
+    
+    def decompress(self, data):
+        raise NotImplementedError
+    
+    def get_stats(self):
+        return {
+            'raw_bytes': self.raw_bytes,
+            'compressed_bytes': self.compressed_bytes,
+            'ratio': round(self.raw_bytes / self.compressed_bytes, 2) if self.compressed_bytes else None,
+            'seconds': round(self.seconds, 3),
+        }
+
+
+class GzipCodec(Codec):
+    """Default block codec; every block is a self-contained gzip member"""
+    
+    name = 'gzip'
+    file_extension = '.gz'
+    
+    def _compress(self, data):
+        return gzip.compress(data)
+    
+    def decompress(self, data):
+        return gzip.decompress(data)
+
+
+class ZstdDictCodec(Codec):
+    """zstd with a dictionary trained on earlier backups of the same database.
+    
+    Small blocks compress poorly on their own because the repeated JSON keys
+    have to be learned again in every block; the dictionary supplies them.
+    """
+    
+    name = 'zstd'
+    file_extension = '.zst'
+    
+    def __init__(self, dictionary_data, level=None):
+        super().__init__()
+        if zstandard is None:
+            raise RuntimeError("zstandard is required for dictionary compression: pip install zstandard")
+        self.dictionary = zstandard.ZstdCompressionDict(dictionary_data)
+        self.level = level or getattr(settings, 'BACKUP_ZSTD_LEVEL', 3)
+        self.compressor = zstandard.ZstdCompressor(level=self.level, dict_data=self.dictionary)
+        self.decompressor = zstandard.ZstdDecompressor(dict_data=self.dictionary)
+    
+    def _compress(self, data):
+        return self.compressor.compress(data)
+    
+    def decompress(self, data):
+        return self.decompressor.decompress(data)
+
+
+def zstd_available():
+    return zstandard is not None
+
+
+def collect_samples(reader, max_table_bytes, max_samples=20000):
+    """Sample rows from the small tables of an earlier backup.
+    
+    Returns (samples, blocks): individual NDJSON rows used to train the
+    dictionary, and the whole decoded blocks they came from, which are
+    used to benchmark the result.
+    """
+    samples, blocks = [], []
+    for entry in reader.get_tables():
+        if entry.get('size') is None or entry['size'] > max_table_bytes:
+            continue
+        rows = reader.read_rows(entry['schema'], entry['table'], 0, getattr(settings, 'BACKUP_BLOCK_ROWS', 10000))
+        lines = [(json.dumps(row) + '\n').encode('utf-8') for row in rows]
+        if not lines:
+            continue
+        samples.extend(lines)
+        blocks.append(b''.join(lines))
+        if len(samples) >= max_samples:
+            break
+    return samples[:max_samples], blocks
+
+
+def train_dictionary(reader, max_table_bytes, dict_size=None):
+    """Train a zstd dictionary from the small tables of an earlier backup.
+    
+    Returns (dictionary_bytes, small_tables, benchmark), or None when
+    zstandard is missing or there is too little data to train on.
+    """
+    if zstandard is None:
+        logger.warning("zstandard is not installed; skipping dictionary training")
+        return None
+    
+    dict_size = dict_size or getattr(settings, 'BACKUP_ZSTD_DICT_SIZE', 112640)
+    samples, blocks = collect_samples(reader, max_table_bytes)
+    if len(samples) < 100:
+        logger.info(f"Only {len(samples)} sample rows available; skipping dictionary training")
+        return None
+    
+    try:
+        dictionary = zstandard.train_dictionary(dict_size, samples)
+    except zstandard.ZstdError as e:
+        logger.warning(f"Dictionary training failed: {str(e)}")
+        return None
+    
+    small_tables = {
+        (entry['schema'], entry['table'])
+        for entry in reader.get_tables()
+        if entry.get('size') is not None and entry['size'] <= max_table_bytes
+    }
+    dictionary_data = dictionary.as_bytes()
+    return dictionary_data, small_tables, benchmark_codecs(blocks, dictionary_data)
+
+
+def benchmark_codecs(blocks, dictionary_data):
+    """Compress the sampled blocks with gzip and with zstd + dictionary and compare.
+    
+    The samples are the training data, so this is a best case; the codec
+    stats recorded while writing the backup show the real result.
+    """
+    gzip_codec = GzipCodec()
+    zstd_codec = ZstdDictCodec(dictionary_data)
+    for block in blocks:
+        gzip_codec.compress(block)
+        zstd_codec.compress(block)
+    
+    gzip_stats, zstd_stats = gzip_codec.get_stats(), zstd_codec.get_stats()
+    return {
+        'sample_blocks': len(blocks),
+        'gzip': gzip_stats,
+        'zstd_dictionary': zstd_stats,
+        'size_reduction': round(1 - zstd_stats['compressed_bytes'] / gzip_stats['compressed_bytes'], 3)
+            if gzip_stats['compressed_bytes'] else None,
+        'speedup': round(gzip_stats['seconds'] / zstd_stats['seconds'], 1) if zstd_stats['seconds'] else None,
+    }
@@ -0,0 +1,66 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from django.utils.crypto import salted_hmac
+from .backup_engine import MSSQLStreamBackup
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def database_cache_key(server_config):
+    """Cache key for a server's database list, keyed by connection target and credentials.
+    
+    The password is part of the key so a cached list is only served to a
+    caller who could have fetched it themselves; it goes through an HMAC
+    keyed with SECRET_KEY rather than into the key in the clear.
+    """
+    target = (
+        f"{server_config['server_address']}:{server_config['port']}:"
+        f"{server_config['username']}:{server_config['password']}"
+    )
+    return 'databases:' + salted_hmac('backup_app.database_cache_key', target, algorithm='sha256').hexdigest()
+
+
+def health_cache_key(server_id):
+    return f'server_health:{server_id}'
+
+
+def get_cached_databases(server_config):
+    """Return the cached database list for a server, or None if it has expired"""
+    return cache.get(database_cache_key(server_config))
+
+
+def discover_databases(server_config, refresh=False):
+    """Return the server's user databases, querying sys.databases only on a cache miss"""
+    if not refresh:
+        databases = get_cached_databases(server_config)
+        if databases is not None:
+            return databases
+    
+    databases = MSSQLStreamBackup(server_config).get_all_databases()
+    cache.set(
+        database_cache_key(server_config),
+        databases,
+        getattr(settings, 'DATABASE_LIST_CACHE_TTL', 300),
+    )
+    return databases
+
+
+def check_server_health(server):
+    """Test the connection to a server and cache the outcome as its health status"""
+    success, message = MSSQLStreamBackup(server.get_server_config()).test_connection()
+    health = {
+        'success': success,
+        'message': message,
+        'checked_at': timezone.now().isoformat(),
+    }
+    cache.set(health_cache_key(server.id), health, getattr(settings, 'SERVER_HEALTH_CACHE_TTL', 600))
+    return health
+
+
+def get_servers_health(servers):
+    """Cached health status for each server; servers never checked are omitted"""
+    keys = {health_cache_key(server.id): server.id for server in servers}
+    cached = cache.get_many(keys.keys())
+    return {keys[key]: health for key, health in cached.items()}
@@ -14,7 +14,10 @@ class SQLServerForm(forms.ModelForm):
     
     class Meta:
         model = SQLServer
-        fields = ['name', 'server_address', 'port', 'username', 'password', 'is_active']
+        fields = [
+            'name', 'server_address', 'port', 'username', 'password', 'is_active',
+            'backup_mode', 'native_backup_dir', 'stripe_count', 'max_transfer_size', 'buffer_count',
+        ]
         widgets = {
             'password': forms.PasswordInput(),
         }
@@ -34,12 +37,26 @@ class SQLServerForm(forms.ModelForm):
             ),
             'is_active',
             HTML('<hr>'),
+            HTML('<h5>Backup Mode</h5>'),
+            Row(
+                Column('backup_mode', css_class='form-group col-md-4 mb-0'),
+                Column('native_backup_dir', css_class='form-group col-md-8 mb-0'),
+            ),
+            Row(
+                Column('stripe_count', css_class='form-group col-md-4 mb-0'),
+                Column('max_transfer_size', css_class='form-group col-md-4 mb-0'),
+                Column('buffer_count', css_class='form-group col-md-4 mb-0'),
+            ),
+            HTML('<hr>'),
             HTML('<h5>Database Selection</h5>'),
             HTML('''
                 <div class="mb-3">
                     <button type="button" id="fetch-databases-btn" class="btn btn-info">
                         <i class="fas fa-download me-1"></i> Fetch Databases from Server
                     </button>
+                    <button type="button" id="refresh-databases-btn" class="btn btn-outline-info" title="Ignore the cached list and query the server again">
+                        <i class="fas fa-sync-alt me-1"></i> Refresh
+                    </button>
                     <div id="fetch-status" class="mt-2"></div>
                 </div>
             '''),
@@ -57,6 +74,22 @@ class SQLServerForm(forms.ModelForm):
             self.fields['selected_databases'].choices = [(db, db) for db in databases]
             self.fields['selected_databases'].initial = databases
     
+    def clean(self):
+        cleaned_data = super().clean()
+        
+        if cleaned_data.get('backup_mode') == 'native' and not cleaned_data.get('native_backup_dir'):
+            self.add_error('native_backup_dir', 'A backup directory on the SQL Server host is required for native backups.')
+        
+        stripe_count = cleaned_data.get('stripe_count')
+        if stripe_count is not None and not 1 <= stripe_count <= 64:
+            self.add_error('stripe_count', 'Stripe count must be between 1 and 64.')
+        
+        max_transfer_size = cleaned_data.get('max_transfer_size')
+        if max_transfer_size and (max_transfer_size % 65536 or max_transfer_size > 4194304):
+            self.add_error('max_transfer_size', 'MAXTRANSFERSIZE must be a multiple of 65536 bytes, up to 4194304.')
+        
+        return cleaned_data
+    
     def save(self, commit=True):
         instance = super().save(commit=False)
         
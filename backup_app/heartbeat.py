@@ -0,0 +1,81 @@
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+from .models import BackupJob
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def get_heartbeat_interval():
+    return getattr(settings, 'BACKUP_HEARTBEAT_INTERVAL', 30)
+
+
+class JobHeartbeat:
+    """Stamps heartbeat_at on a BackupJob (or another ``model`` with the same
+    status and heartbeat_at fields, such as BulkOperation) every
+    BACKUP_HEARTBEAT_INTERVAL seconds from a background thread for as long
+    as it is running.
+    
+    The heartbeat is a single-column UPDATE, so it never overwrites fields
+    the task itself is changing.
+    """
+    
+    def __init__(self, job_id, interval=None, model=BackupJob):
+        self.job_id = job_id
+        self.model = model
+        self.interval = interval or get_heartbeat_interval()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name=f'heartbeat-job-{job_id}', daemon=True)
+    
+    def __enter__(self):
+        self.thread.start()
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stopped.set()
+        self.thread.join()
+        return False
+    
+    def run(self):
+        try:
+            while not self.stopped.wait(self.interval):
+                try:
+                    self.model.objects.filter(pk=self.job_id, status='running').update(heartbeat_at=timezone.now())
+                except Exception as e:
+                    logger.warning(f"Heartbeat for {self.model.__name__} {self.job_id} failed: {str(e)}")
+        finally:
+            # The thread has its own database connection; don't leak it
+            connection.close()
+
+
+def get_live_workers(timeout=1.0):
+    """Hostnames of Celery workers answering a ping, or None if they can't be inspected"""
+    from celery import current_app
+    
+    try:
+        replies = current_app.control.inspect(timeout=timeout).ping()
+    except Exception as e:
+        logger.warning(f"Could not ping Celery workers: {str(e)}")
+        return None
+    return set(replies or {})
+
+
+def is_job_stale(job, now, live_workers=None):
+    """A running job (or bulk operation) is stale when its heartbeat is older than BACKUP_HEARTBEAT_TIMEOUT,
+    or older than two intervals while its worker no longer answers pings."""
+    last_seen = job.heartbeat_at or job.started_at
+    if last_seen is None:
+        return False
+    
+    age = (now - last_seen).total_seconds()
+    if age > getattr(settings, 'BACKUP_HEARTBEAT_TIMEOUT', 5 * get_heartbeat_interval()):
+        return True
+    
+    worker_gone = (
+        live_workers is not None
+        and job.worker_hostname
+        and job.worker_hostname not in live_workers
+    )
+    return bool(worker_gone and age > 2 * get_heartbeat_interval())
@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand, CommandError
+from backup_app.models import BackupJob
+from backup_app.backup_diff import compare_backups
+import json
+
+
+class Command(BaseCommand):
+    help = "Compare two streaming backups and list the tables and row ranges that changed"
+    
+    def add_arguments(self, parser):
+        parser.add_argument('old', help="BackupJob id or path of the older backup")
+        parser.add_argument('new', help="BackupJob id or path of the newer backup")
+        parser.add_argument('--workers', type=int, help="Tables compared in parallel (default BACKUP_COMPARE_CONCURRENCY)")
+        parser.add_argument('--json', action='store_true', help="Print the full comparison as JSON")
+    
+    def resolve(self, backup):
+        if backup.isdigit():
+            try:
+                return BackupJob.objects.get(pk=int(backup)).backup_path
+            except BackupJob.DoesNotExist:
+                raise CommandError(f"Backup job {backup} does not exist")
+        return backup
+    
+    def handle(self, *args, **options):
+        old, new = self.resolve(options['old']), self.resolve(options['new'])
+        try:
+            diff = compare_backups(old, new, max_workers=options['workers'])
+        except FileNotFoundError as e:
+            raise CommandError(f"No backup manifest found: {str(e)}")
+        
+        if options['json']:
+            self.stdout.write(json.dumps(diff, indent=2))
+            return
+        
+        for result in diff['tables']:
+            name = f"{result['schema']}.{result['table']}"
+            status = result['status']
+            if status == 'unchanged':
+                continue
+            if status == 'changed':
+                ranges = ', '.join(f"{start}-{stop - 1}" for start, stop in result['changed_ranges'])
+                detail = 'columns changed' if result.get('columns_changed') else f"rows {ranges}"
+                self.stdout.write(self.style.WARNING(
+                    f"{name}: changed ({result['old_rows']} -> {result['new_rows']} rows; {detail})"
+                ))
+            elif status == 'error':
+                self.stdout.write(self.style.ERROR(f"{name}: {result['error']}"))
+            else:
+                self.stdout.write(f"{name}: {status}")
+        
+        summary = diff['summary']
+        self.stdout.write(self.style.SUCCESS(
+            f"{summary['changed']} changed, {summary['added']} added, {summary['removed']} removed, "
+            f"{summary['unchanged']} unchanged; {summary['blocks_decoded']} blocks decoded"
+        ))
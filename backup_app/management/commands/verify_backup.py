@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+from backup_app.models import BackupJob
+from backup_app.backup_reader import BackupReader
+
+
+class Command(BaseCommand):
+    help = "Decode every table in a streaming backup and check row counts against its index"
+    
+    def add_arguments(self, parser):
+        parser.add_argument('backup', help="BackupJob id or path to a backup directory")
+    
+    def handle(self, *args, **options):
+        backup = options['backup']
+        if backup.isdigit():
+            try:
+                backup = BackupJob.objects.get(pk=int(backup)).backup_path
+            except BackupJob.DoesNotExist:
+                raise CommandError(f"Backup job {backup} does not exist")
+        
+        reader = BackupReader(backup)
+        try:
+            tables = reader.get_tables()
+        except FileNotFoundError:
+            raise CommandError(f"No backup manifest found in {backup}")
+        
+        problems = reader.verify()
+        for schema_name, table_name, error in problems:
+            self.stdout.write(self.style.ERROR(f"{schema_name}.{table_name}: {error}"))
+        
+        if problems:
+            raise CommandError(f"{len(problems)} of {len(tables)} tables failed verification")
+        self.stdout.write(self.style.SUCCESS(f"All {len(tables)} tables verified"))
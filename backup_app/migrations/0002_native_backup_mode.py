@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-19 06:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backup_app', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sqlserver',
+            name='backup_mode',
+            field=models.CharField(choices=[('streaming_json', 'Streaming JSON export'), ('native', 'Native BACKUP DATABASE')], default='streaming_json', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='sqlserver',
+            name='buffer_count',
+            field=models.PositiveIntegerField(blank=True, help_text='BUFFERCOUNT', null=True),
+        ),
+        migrations.AddField(
+            model_name='sqlserver',
+            name='max_transfer_size',
+            field=models.PositiveIntegerField(blank=True, help_text='MAXTRANSFERSIZE in bytes (multiple of 64 KB, up to 4 MB)', null=True),
+        ),
+        migrations.AddField(
+            model_name='sqlserver',
+            name='native_backup_dir',
+            field=models.CharField(blank=True, help_text='Directory on the SQL Server host where .bak files are written', max_length=500),
+        ),
+        migrations.AddField(
+            model_name='sqlserver',
+            name='stripe_count',
+            field=models.PositiveSmallIntegerField(default=1, help_text='Number of backup files to stripe across'),
+        ),
+    ]
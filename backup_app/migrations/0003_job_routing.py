@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 07:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backup_app', '0002_native_backup_mode'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='backupjob',
+            name='estimated_duration',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='backupjob',
+            name='queue',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-19 07:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backup_app', '0003_job_routing'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='backupjob',
+            name='attempts',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='backupjob',
+            name='heartbeat_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='backupjob',
+            name='worker_hostname',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+    ]
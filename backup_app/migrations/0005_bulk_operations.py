@@ -0,0 +1,55 @@
+# Generated by Django 5.2.18 on 2026-10-19 07:11
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backup_app', '0004_job_heartbeat'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BulkOperation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('action', models.CharField(choices=[('backup', 'Backup all servers'), ('test', 'Test all connections'), ('refresh_databases', 'Refresh database lists')], max_length=30)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('completed', 'Completed'), ('failed', 'Failed')], default='pending', max_length=20)),
+                ('concurrency', models.PositiveIntegerField(default=1)),
+                ('total_servers', models.PositiveIntegerField(default=0)),
+                ('processed_servers', models.PositiveIntegerField(default=0)),
+                ('failed_servers', models.PositiveIntegerField(default=0)),
+                ('task_id', models.CharField(blank=True, max_length=255)),
+                ('error_message', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.AddField(
+            model_name='backupjob',
+            name='bulk_operation',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='backup_jobs', to='backup_app.bulkoperation'),
+        ),
+        migrations.CreateModel(
+            name='BulkOperationResult',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('success', models.BooleanField(default=False)),
+                ('message', models.TextField(blank=True)),
+                ('details', models.JSONField(blank=True, default=dict)),
+                ('finished_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('operation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='results', to='backup_app.bulkoperation')),
+                ('server', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='backup_app.sqlserver')),
+            ],
+            options={
+                'ordering': ['finished_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 07:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backup_app', '0005_bulk_operations'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='backupjob',
+            name='backup_path',
+            field=models.TextField(blank=True),
+        ),
+    ]
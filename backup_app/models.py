@@ -1,8 +1,14 @@
 from django.db import models
 from django.utils import timezone
+from datetime import timedelta
 import json
 
 class SQLServer(models.Model):
+    BACKUP_MODE_CHOICES = [
+        ('streaming_json', 'Streaming JSON export'),
+        ('native', 'Native BACKUP DATABASE'),
+    ]
+    
     name = models.CharField(max_length=100, unique=True)
     server_address = models.CharField(max_length=255)
     port = models.IntegerField(default=1433)
@@ -12,6 +18,19 @@ class SQLServer(models.Model):
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
     
+    # Native backup settings (only used when backup_mode is 'native')
+    backup_mode = models.CharField(max_length=20, choices=BACKUP_MODE_CHOICES, default='streaming_json')
+    native_backup_dir = models.CharField(
+        max_length=500, blank=True,
+        help_text="Directory on the SQL Server host where .bak files are written"
+    )
+    stripe_count = models.PositiveSmallIntegerField(default=1, help_text="Number of backup files to stripe across")
+    max_transfer_size = models.PositiveIntegerField(
+        null=True, blank=True,
+        help_text="MAXTRANSFERSIZE in bytes (multiple of 64 KB, up to 4 MB)"
+    )
+    buffer_count = models.PositiveIntegerField(null=True, blank=True, help_text="BUFFERCOUNT")
+    
     def __str__(self):
         return self.name
     
@@ -23,6 +42,21 @@ class SQLServer(models.Model):
     
     def set_databases(self, db_list):
         self.databases = json.dumps(db_list)
+    
+    def get_server_config(self):
+        """Connection and backup settings passed to the backup engine"""
+        return {
+            'name': self.name,
+            'server_address': self.server_address,
+            'port': self.port,
+            'username': self.username,
+            'password': self.password,
+            'backup_mode': self.backup_mode,
+            'native_backup_dir': self.native_backup_dir,
+            'stripe_count': self.stripe_count,
+            'max_transfer_size': self.max_transfer_size,
+            'buffer_count': self.buffer_count,
+        }
 
 class BackupJob(models.Model):
     STATUS_CHOICES = [
@@ -38,15 +72,30 @@ class BackupJob(models.Model):
     started_at = models.DateTimeField(null=True, blank=True)
     completed_at = models.DateTimeField(null=True, blank=True)
     error_message = models.TextField(blank=True)
-    backup_path = models.CharField(max_length=500, blank=True)
+    backup_path = models.TextField(blank=True)  # Backup location; native backups list every stripe file, ';'-separated
     file_size = models.BigIntegerField(null=True, blank=True)
     task_id = models.CharField(max_length=255, blank=True)  # Celery task ID
+    queue = models.CharField(max_length=100, blank=True)  # Celery queue the job was routed to
+    estimated_duration = models.FloatField(null=True, blank=True)  # Seconds, from job history
+    worker_hostname = models.CharField(max_length=255, blank=True)  # Celery worker running the job
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    bulk_operation = models.ForeignKey(  # Fleet-wide operation that queued the job, if any
+        'BulkOperation', null=True, blank=True, on_delete=models.SET_NULL, related_name='backup_jobs'
+    )
     
     class Meta:
         ordering = ['-started_at']
     
     def __str__(self):
         return f"{self.server.name} - {self.database_name} ({self.status})"
+    
+    @property
+    def predicted_completion(self):
+        """Expected finish time of a running job, based on its estimated duration"""
+        if self.status != 'running' or not self.started_at or self.estimated_duration is None:
+            return None
+        return self.started_at + timedelta(seconds=self.estimated_duration)
 
 class BackupSchedule(models.Model):
     FREQUENCY_CHOICES = [
@@ -63,4 +112,63 @@ class BackupSchedule(models.Model):
     last_run = models.DateTimeField(null=True, blank=True)
     
     def __str__(self):
-        return f"{self.server.name} - {self.frequency}"
\ No newline at end of file
+        return f"{self.server.name} - {self.frequency}"
+
+class BulkOperation(models.Model):
+    """An action run against every active server at once"""
+    ACTION_CHOICES = [
+        ('backup', 'Backup all servers'),
+        ('test', 'Test all connections'),
+        ('refresh_databases', 'Refresh database lists'),
+    ]
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    ]
+    
+    action = models.CharField(max_length=30, choices=ACTION_CHOICES)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    concurrency = models.PositiveIntegerField(default=1)
+    total_servers = models.PositiveIntegerField(default=0)
+    processed_servers = models.PositiveIntegerField(default=0)
+    failed_servers = models.PositiveIntegerField(default=0)
+    task_id = models.CharField(max_length=255, blank=True)  # Celery task ID
+    worker_hostname = models.CharField(max_length=255, blank=True)  # Celery worker running the operation
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    error_message = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+    
+    def __str__(self):
+        return f"{self.get_action_display()} ({self.status})"
+    
+    @property
+    def succeeded_servers(self):
+        return self.processed_servers - self.failed_servers
+    
+    @property
+    def percent_complete(self):
+        if not self.total_servers:
+            return 100 if self.status == 'completed' else 0
+        return int(100 * self.processed_servers / self.total_servers)
+
+class BulkOperationResult(models.Model):
+    """Outcome of a bulk operation on one server"""
+    operation = models.ForeignKey(BulkOperation, on_delete=models.CASCADE, related_name='results')
+    server = models.ForeignKey(SQLServer, on_delete=models.CASCADE)
+    success = models.BooleanField(default=False)
+    message = models.TextField(blank=True)
+    details = models.JSONField(default=dict, blank=True)
+    finished_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        ordering = ['finished_at']
+    
+    def __str__(self):
+        return f"{self.operation} - {self.server.name}"
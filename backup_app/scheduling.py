@@ -0,0 +1,116 @@
+from collections import defaultdict
+from datetime import timedelta
+from django.conf import settings
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+from django.utils import timezone
+from .models import BackupJob
+
+
+def get_small_queue():
+    return getattr(settings, 'BACKUP_SMALL_QUEUE', 'backups_small')
+
+
+def get_large_queue():
+    return getattr(settings, 'BACKUP_LARGE_QUEUE', 'backups_large')
+
+
+def get_job_history(server, database_names):
+    """Recent completed jobs per database as {name: [(duration_seconds, file_size), ...]}"""
+    sample = getattr(settings, 'BACKUP_HISTORY_SAMPLE', 5)
+    history = defaultdict(list)
+    
+    # Number each database's jobs newest first and keep the first few, so a
+    # database without much history doesn't pull in the whole server's
+    jobs = BackupJob.objects.filter(
+        server=server,
+        database_name__in=set(database_names),
+        status='completed',
+        started_at__isnull=False,
+        completed_at__isnull=False,
+    ).annotate(
+        recency=Window(RowNumber(), partition_by=F('database_name'), order_by=F('completed_at').desc()),
+    ).filter(recency__lte=sample).order_by('-completed_at').values_list(
+        'database_name', 'started_at', 'completed_at', 'file_size'
+    )
+    
+    for database_name, started_at, completed_at, file_size in jobs:
+        history[database_name].append(((completed_at - started_at).total_seconds(), file_size or 0))
+    
+    return history
+
+
+def estimate_job(samples):
+    """Estimated (duration_seconds, file_size) from a database's recent history"""
+    if not samples:
+        return getattr(settings, 'BACKUP_DEFAULT_ESTIMATE_SECONDS', 300), None
+    durations = [duration for duration, _ in samples]
+    sizes = [size for _, size in samples]
+    return sum(durations) / len(durations), sum(sizes) // len(sizes)
+
+
+def choose_queue(estimated_duration, estimated_size):
+    """Large jobs get their own worker pool so they can't hold up the small ones"""
+    if estimated_duration >= getattr(settings, 'BACKUP_LARGE_JOB_SECONDS', 1800):
+        return get_large_queue()
+    if estimated_size and estimated_size >= getattr(settings, 'BACKUP_LARGE_JOB_BYTES', 10 * 1024 ** 3):
+        return get_large_queue()
+    return get_small_queue()
+
+
+def plan_server_backup(server, database_names):
+    """Estimate, route and order a server's databases for dispatch.
+    
+    Returns a list of dicts with database_name, estimated_duration,
+    estimated_size and queue, ordered by BACKUP_DISPATCH_ORDER
+    ('shortest_first' or 'longest_first').
+    """
+    history = get_job_history(server, database_names)
+    plan = []
+    for database_name in database_names:
+        estimated_duration, estimated_size = estimate_job(history.get(database_name))
+        plan.append({
+            'database_name': database_name,
+            'estimated_duration': estimated_duration,
+            'estimated_size': estimated_size,
+            'queue': choose_queue(estimated_duration, estimated_size),
+        })
+    
+    order = getattr(settings, 'BACKUP_DISPATCH_ORDER', 'shortest_first')
+    plan.sort(key=lambda item: item['estimated_duration'], reverse=(order == 'longest_first'))
+    return plan
+
+
+def predict_queue_eta(now=None):
+    """Predict when the currently queued and running jobs will all be finished.
+    
+    Remaining work in each queue is divided by that queue's worker count
+    from BACKUP_QUEUE_WORKERS; the slowest queue determines the ETA.
+    Returns None when nothing is queued.
+    """
+    now = now or timezone.now()
+    workers = getattr(settings, 'BACKUP_QUEUE_WORKERS', {})
+    remaining = defaultdict(float)
+    
+    active_jobs = BackupJob.objects.filter(status__in=['pending', 'running']).values_list(
+        'status', 'started_at', 'estimated_duration', 'queue'
+    )
+    for status, started_at, estimated_duration, queue in active_jobs:
+        estimate = estimated_duration or getattr(settings, 'BACKUP_DEFAULT_ESTIMATE_SECONDS', 300)
+        if status == 'running' and started_at:
+            estimate = max(estimate - (now - started_at).total_seconds(), 0)
+        remaining[queue or get_small_queue()] += estimate
+    
+    if not remaining:
+        return None
+    
+    per_queue = {
+        queue: seconds / max(workers.get(queue, 1), 1)
+        for queue, seconds in remaining.items()
+    }
+    seconds = max(per_queue.values())
+    return {
+        'eta': now + timedelta(seconds=seconds),
+        'remaining_seconds': seconds,
+        'per_queue': per_queue,
+    }
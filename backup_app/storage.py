@@ -0,0 +1,348 @@
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+import io
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+# S3 multipart limits: at most 10,000 parts of up to 5 GB each
+MAX_PARTS = 10000
+MAX_PART_SIZE = 5 * 1024 ** 3
+# Parts double in size every this many parts, so a file that outgrows its
+# initial part size keeps going instead of failing at part 10,001
+PART_SIZE_DOUBLING_INTERVAL = 1000
+
+
+class BackupStorage:
+    """Where backup files are written and read back from.
+    
+    Names are '/'-separated paths relative to the storage root.
+    """
+    
+    def open_write(self, name):
+        """Return a writable binary file object for ``name``"""
+        raise NotImplementedError
+    
+    def open_read(self, name):
+        """Return a seekable, readable binary file object for ``name``"""
+        raise NotImplementedError
+    
+    def exists(self, name):
+        raise NotImplementedError
+    
+    def location(self, name=''):
+        """String identifying ``name`` that storage_for_location() can resolve again"""
+        raise NotImplementedError
+    
+    def discard(self, f, name):
+        """Throw away a file opened with open_write() without publishing it,
+        e.g. after the export writing to it failed"""
+        raise NotImplementedError
+    
+    def write_bytes(self, name, data):
+        with self.open_write(name) as f:
+            f.write(data)
+    
+    def read_bytes(self, name):
+        with self.open_read(name) as f:
+            return f.read()
+
+
+class LocalStorage(BackupStorage):
+    """Backups on the local filesystem under ``root``"""
+    
+    def __init__(self, root):
+        self.root = Path(root)
+    
+    def path(self, name):
+        return self.root / name if name else self.root
+    
+    def open_write(self, name):
+        path = self.path(name)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        return open(path, 'wb')
+    
+    def open_read(self, name):
+        return open(self.path(name), 'rb')
+    
+    def exists(self, name):
+        return self.path(name).is_file()
+    
+    def discard(self, f, name):
+        f.close()
+        self.path(name).unlink(missing_ok=True)
+    
+    def location(self, name=''):
+        return str(self.path(name))
+
+
+class S3MultipartWriter(io.RawIOBase):
+    """File object that uploads to S3 as it is written.
+    
+    Data is cut into ``part_size`` parts which are uploaded by up to
+    ``concurrency`` threads while the caller keeps writing. At most
+    ``concurrency`` parts are in flight, which bounds memory use. Objects
+    smaller than one part are sent with a single PutObject on close.
+    
+    The size of a file isn't known up front, so to stay within S3's 10,000
+    part limit the part size doubles every 1,000 parts: 8 MB parts take a
+    file to 8 GB before growing, and past S3's 5 TB object size limit
+    before running out of parts.
+    """
+    
+    def __init__(self, client, bucket, key, part_size, concurrency):
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.part_size = part_size
+        self.concurrency = concurrency
+        self.buffer = bytearray()
+        self.upload_id = None
+        self.executor = None
+        self.futures = []
+        self.slots = threading.BoundedSemaphore(concurrency)
+        self.error = None
+        self.size = 0
+    
+    def writable(self):
+        return True
+    
+    def tell(self):
+        return self.size
+    
+    def write(self, data):
+        self.buffer.extend(data)
+        self.size += len(data)
+        while len(self.buffer) >= self.next_part_size():
+            part_size = self.next_part_size()
+            part = bytes(self.buffer[:part_size])
+            del self.buffer[:part_size]
+            self.submit_part(part)
+        return len(data)
+    
+    def next_part_size(self):
+        growth = 2 ** (len(self.futures) // PART_SIZE_DOUBLING_INTERVAL)
+        return min(self.part_size * growth, MAX_PART_SIZE)
+    
+    def submit_part(self, data):
+        if self.upload_id is None:
+            response = self.client.create_multipart_upload(Bucket=self.bucket, Key=self.key)
+            self.upload_id = response['UploadId']
+            self.executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        
+        part_number = len(self.futures) + 1
+        if part_number > MAX_PARTS:
+            raise OSError(f"{self.key} is too large for S3: it needs more than {MAX_PARTS} parts")
+        # Blocks the writer once `concurrency` parts are waiting to upload
+        self.slots.acquire()
+        if self.error is not None:
+            # Stop at the first failed part rather than uploading the rest first
+            self.slots.release()
+            raise self.error
+        future = self.executor.submit(self.upload_part, part_number, data)
+        future.add_done_callback(self.part_done)
+        self.futures.append(future)
+    
+    def part_done(self, future):
+        if not future.cancelled() and future.exception() is not None and self.error is None:
+            self.error = future.exception()
+        self.slots.release()
+    
+    def upload_part(self, part_number, data):
+        response = self.client.upload_part(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self.upload_id,
+            PartNumber=part_number,
+            Body=data,
+        )
+        return {'PartNumber': part_number, 'ETag': response['ETag']}
+    
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if self.upload_id is None:
+                self.client.put_object(Bucket=self.bucket, Key=self.key, Body=bytes(self.buffer))
+            else:
+                if self.buffer:
+                    self.submit_part(bytes(self.buffer))
+                parts = [future.result() for future in self.futures]
+                self.client.complete_multipart_upload(
+                    Bucket=self.bucket,
+                    Key=self.key,
+                    UploadId=self.upload_id,
+                    MultipartUpload={'Parts': parts},
+                )
+        except Exception:
+            # Lets parts still in flight finish before aborting, so none land in the aborted upload
+            self.discard()
+            raise
+        finally:
+            self.buffer = bytearray()
+            if self.executor is not None:
+                self.executor.shutdown(wait=True)
+            super().close()
+    
+    def abort(self):
+        """Discard the upload, e.g. after an error while writing"""
+        if self.upload_id is not None:
+            try:
+                self.client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+            except Exception as e:
+                logger.warning(f"Failed to abort multipart upload of {self.key}: {str(e)}")
+            self.upload_id = None
+    
+    def discard(self):
+        """Close without completing the upload, so nothing is published"""
+        if self.closed:
+            return
+        if self.executor is not None:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+        self.abort()
+        self.buffer = bytearray()
+        super().close()
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.discard()
+            return False
+        self.close()
+        return False
+
+
+class S3RangeReader(io.RawIOBase):
+    """Seekable file object over an S3 object, fetching each read with a ranged GET"""
+    
+    def __init__(self, client, bucket, key):
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.position = 0
+    
+    def readable(self):
+        return True
+    
+    def seekable(self):
+        return True
+    
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self.position = offset
+        elif whence == io.SEEK_CUR:
+            self.position += offset
+        else:
+            size = self.client.head_object(Bucket=self.bucket, Key=self.key)['ContentLength']
+            self.position = size + offset
+        return self.position
+    
+    def tell(self):
+        return self.position
+    
+    def read(self, size=-1):
+        if size == 0:
+            return b''
+        byte_range = f"bytes={self.position}-" if size is None or size < 0 else f"bytes={self.position}-{self.position + size - 1}"
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=self.key, Range=byte_range)
+        except self.client.exceptions.ClientError as e:
+            # Reading at or past the end of the object
+            if e.response.get('Error', {}).get('Code') == 'InvalidRange':
+                return b''
+            raise
+        data = response['Body'].read()
+        self.position += len(data)
+        return data
+    
+    def readinto(self, b):
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+
+class S3Storage(BackupStorage):
+    """Backups in an S3-compatible bucket (AWS S3, MinIO, ...)"""
+    
+    def __init__(self, bucket, prefix='', endpoint_url=None, region_name=None,
+                 access_key=None, secret_key=None, part_size=8 * 1024 * 1024, concurrency=4, client=None):
+        if part_size < 5 * 1024 * 1024:
+            raise ImproperlyConfigured("S3 multipart part_size must be at least 5 MB")
+        self.bucket = bucket
+        self.prefix = prefix.strip('/')
+        self.part_size = part_size
+        self.concurrency = concurrency
+        self.client = client or self.create_client(endpoint_url, region_name, access_key, secret_key, concurrency)
+    
+    @staticmethod
+    def create_client(endpoint_url, region_name, access_key, secret_key, concurrency):
+        try:
+            import boto3
+            from botocore.config import Config
+        except ImportError:
+            raise ImproperlyConfigured("boto3 is required for S3 backup storage: pip install boto3")
+        
+        return boto3.client(
+            's3',
+            endpoint_url=endpoint_url,
+            region_name=region_name,
+            aws_access_key_id=access_key,
+            aws_secret_access_key=secret_key,
+            # Leave room in the connection pool for every part in flight
+            config=Config(max_pool_connections=max(10, concurrency * 2)),
+        )
+    
+    def key(self, name):
+        return '/'.join(part for part in (self.prefix, name.strip('/')) if part)
+    
+    def open_write(self, name):
+        return S3MultipartWriter(self.client, self.bucket, self.key(name), self.part_size, self.concurrency)
+    
+    def open_read(self, name):
+        if not self.exists(name):
+            raise FileNotFoundError(self.location(name))
+        return S3RangeReader(self.client, self.bucket, self.key(name))
+    
+    def discard(self, f, name):
+        f.discard()
+    
+    def exists(self, name):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self.key(name))
+            return True
+        except self.client.exceptions.ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+    
+    def location(self, name=''):
+        return f"s3://{self.bucket}/{self.key(name)}"
+
+
+def get_storage_options():
+    config = getattr(settings, 'BACKUP_STORAGE', {}) or {}
+    return config.get('BACKEND', 'local'), dict(config.get('OPTIONS', {}))
+
+
+def get_storage():
+    """Storage backend configured by settings.BACKUP_STORAGE, rooted at the backup root"""
+    backend, options = get_storage_options()
+    if backend == 'local':
+        return LocalStorage(options.get('root', settings.BACKUP_ROOT))
+    if backend == 's3':
+        return S3Storage(**options)
+    raise ImproperlyConfigured(f"Unknown backup storage backend: {backend}")
+
+
+def storage_for_location(location):
+    """Storage rooted at a location previously returned by BackupStorage.location()"""
+    if location.startswith('s3://'):
+        bucket, _, prefix = location[len('s3://'):].partition('/')
+        _, options = get_storage_options()
+        options.pop('bucket', None)
+        options.pop('prefix', None)
+        options.pop('root', None)
+        return S3Storage(bucket, prefix=prefix, **options)
+    return LocalStorage(location)
@@ -1,73 +1,199 @@
 from celery import shared_task
+from django.conf import settings
+from django.core.cache import cache
 from django.utils import timezone
-from .models import BackupJob, SQLServer
-from .backup_engine import MSSQLStreamBackup
+from .models import BackupJob, BulkOperation, SQLServer
+from .backup_engine import get_backup_engine
+from .scheduling import plan_server_backup, get_small_queue
+from .heartbeat import JobHeartbeat, get_live_workers, is_job_stale
+from .discovery import check_server_health, discover_databases
+from .bulk import run_bulk_operation
 import logging
 
 logger = logging.getLogger(__name__)
 
-@shared_task
-def backup_database_task(job_id):
+@shared_task(bind=True)
+def backup_database_task(self, job_id):
     """Background task to backup a database"""
+    job = None
     try:
         job = BackupJob.objects.get(id=job_id)
         job.status = 'running'
         job.started_at = timezone.now()
-        job.save()
+        job.heartbeat_at = job.started_at
+        job.worker_hostname = self.request.hostname or ''
+        job.attempts += 1
+        # Clear the reason a requeued job was reaped; it no longer applies
+        job.error_message = ''
+        job.save(update_fields=['status', 'started_at', 'heartbeat_at', 'worker_hostname', 'attempts', 'error_message'])
         
-        # Get server configuration
-        server = job.server
-        server_config = {
-            'name': server.name,
-            'server_address': server.server_address,
-            'port': server.port,
-            'username': server.username,
-            'password': server.password,
-        }
+        # Initialize backup engine for the server's backup mode
+        backup_engine = get_backup_engine(job.server.get_server_config())
         
-        # Initialize backup engine
-        backup_engine = MSSQLStreamBackup(server_config)
+        # The previous backup of this database seeds the compression dictionary
+        previous_backup = BackupJob.objects.filter(
+            server=job.server,
+            database_name=job.database_name,
+            status='completed',
+        ).exclude(backup_path='').order_by('-completed_at').values_list('backup_path', flat=True).first()
         
-        # Perform backup
-        backup_path, file_size = backup_engine.backup_database(
-            job.database_name,
-            progress_callback=lambda msg: logger.info(f"Job {job_id}: {msg}")
-        )
+        # Perform backup, heart-beating so the reaper can tell we're alive
+        with JobHeartbeat(job.id):
+            backup_path, file_size = backup_engine.backup_database(
+                job.database_name,
+                progress_callback=lambda msg: logger.info(f"Job {job_id}: {msg}"),
+                dictionary_source=previous_backup,
+            )
         
         # Update job status
         job.status = 'completed'
         job.completed_at = timezone.now()
         job.backup_path = backup_path
         job.file_size = file_size
-        job.save()
+        job.save(update_fields=['status', 'completed_at', 'backup_path', 'file_size'])
         
         logger.info(f"Backup job {job_id} completed successfully")
         return f"Backup completed: {backup_path}"
-        
+    
     except Exception as e:
         logger.error(f"Backup job {job_id} failed: {str(e)}")
-        job.status = 'failed'
-        job.completed_at = timezone.now()
-        job.error_message = str(e)
-        job.save()
+        if job is not None:
+            job.status = 'failed'
+            job.completed_at = timezone.now()
+            job.error_message = str(e)
+            job.save(update_fields=['status', 'completed_at', 'error_message'])
         raise
 
-@shared_task
-def backup_server_databases(server_id):
-    """Backup all databases for a server"""
-    server = SQLServer.objects.get(id=server_id)
-    databases = server.get_databases()
+def queue_server_backup(server, bulk_operation=None):
+    """Create and dispatch a backup job for each of a server's databases.
     
+    Jobs are routed to the small or large backup queue and dispatched in
+    BACKUP_DISPATCH_ORDER, using durations and sizes of earlier backups.
+    Returns the new job ids.
+    """
     job_ids = []
-    for db_name in databases:
+    for item in plan_server_backup(server, server.get_databases()):
         job = BackupJob.objects.create(
             server=server,
-            database_name=db_name,
-            status='pending'
+            database_name=item['database_name'],
+            status='pending',
+            queue=item['queue'],
+            estimated_duration=item['estimated_duration'],
+            bulk_operation=bulk_operation,
         )
-        task = backup_database_task.delay(job.id)
+        task = backup_database_task.apply_async(args=[job.id], queue=item['queue'])
         job.task_id = task.id
-        job.save()
+        job.save(update_fields=['task_id'])
         job_ids.append(job.id)
     
-    return job_ids
\ No newline at end of file
+    return job_ids
+
+@shared_task
+def backup_server_databases(server_id):
+    """Backup all databases for a server"""
+    server = SQLServer.objects.get(id=server_id)
+    return queue_server_backup(server)
+
+@shared_task
+def test_connection_task(server_id):
+    """Test a server connection and cache its health status"""
+    server = SQLServer.objects.get(id=server_id)
+    return check_server_health(server)
+
+@shared_task(bind=True)
+def bulk_operation_task(self, operation_id):
+    """Run a fleet-wide bulk operation, fanning out across the active servers"""
+    operation = BulkOperation.objects.get(id=operation_id)
+    operation.worker_hostname = self.request.hostname or ''
+    operation.save(update_fields=['worker_hostname'])
+    
+    # Heart-beat so the reaper can fail the operation if this worker dies
+    with JobHeartbeat(operation.id, model=BulkOperation):
+        run_bulk_operation(operation)
+    return {'processed': operation.processed_servers, 'failed': operation.failed_servers}
+
+@shared_task
+def fetch_databases_task(request_key, refresh=False):
+    """Discover databases for connection details stashed in the cache by the view.
+    
+    Credentials are passed through the cache rather than the task arguments
+    so they never end up in the broker or in worker logs.
+    """
+    server_config = cache.get(request_key)
+    cache.delete(request_key)
+    if server_config is None:
+        return {'success': False, 'message': 'Request expired, please try again.'}
+    
+    try:
+        databases = discover_databases(server_config, refresh=refresh)
+    except Exception as e:
+        return {'success': False, 'message': str(e)}
+    
+    return {
+        'success': True,
+        'databases': databases,
+        'message': f'Found {len(databases)} databases',
+    }
+
+@shared_task
+def reap_stale_jobs():
+    """Requeue or fail running jobs whose worker has stopped heart-beating.
+    
+    Jobs are requeued until they have run BACKUP_MAX_ATTEMPTS times, then
+    marked as failed. The dead worker's hostname is logged and kept in the
+    error message so lost capacity can be traced back to a host. Stale bulk
+    operations are always marked as failed: rerunning one would repeat the
+    servers it already handled.
+    """
+    from celery import current_app
+    
+    now = timezone.now()
+    live_workers = get_live_workers()
+    requeue = getattr(settings, 'BACKUP_REAP_REQUEUE', True)
+    max_attempts = getattr(settings, 'BACKUP_MAX_ATTEMPTS', 3)
+    requeued, failed = [], []
+    
+    for job in BackupJob.objects.filter(status='running'):
+        if not is_job_stale(job, now, live_workers):
+            continue
+        
+        worker = job.worker_hostname or 'unknown worker'
+        last_seen = job.heartbeat_at or job.started_at
+        reason = f"Worker {worker} stopped responding (last heartbeat {last_seen.isoformat()})"
+        logger.warning(f"Reaping backup job {job.id}: {reason}")
+        
+        if job.task_id:
+            # In case the worker is alive but wedged
+            current_app.control.revoke(job.task_id, terminate=True)
+        
+        # Only claim the job if nothing else has touched it since we looked
+        claimed = BackupJob.objects.filter(pk=job.pk, status='running', heartbeat_at=job.heartbeat_at)
+        if requeue and job.attempts < max_attempts:
+            if not claimed.update(status='pending', error_message=reason, heartbeat_at=None):
+                continue
+            task = backup_database_task.apply_async(args=[job.id], queue=job.queue or get_small_queue())
+            BackupJob.objects.filter(pk=job.pk).update(task_id=task.id)
+            requeued.append(job.id)
+        else:
+            if not claimed.update(status='failed', completed_at=now, error_message=reason):
+                continue
+            failed.append(job.id)
+    
+    failed_operations = []
+    for operation in BulkOperation.objects.filter(status='running'):
+        if not is_job_stale(operation, now, live_workers):
+            continue
+        
+        worker = operation.worker_hostname or 'unknown worker'
+        last_seen = operation.heartbeat_at or operation.started_at
+        reason = f"Worker {worker} stopped responding (last heartbeat {last_seen.isoformat()})"
+        logger.warning(f"Reaping bulk operation {operation.id}: {reason}")
+        
+        if operation.task_id:
+            current_app.control.revoke(operation.task_id, terminate=True)
+        
+        claimed = BulkOperation.objects.filter(pk=operation.pk, status='running', heartbeat_at=operation.heartbeat_at)
+        if claimed.update(status='failed', completed_at=now, error_message=reason):
+            failed_operations.append(operation.id)
+    
+    return {'requeued': requeued, 'failed': failed, 'failed_operations': failed_operations}
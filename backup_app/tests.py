@@ -1,3 +1,1177 @@
-from django.test import TestCase
+from collections import namedtuple
+from datetime import timedelta
+from unittest import mock
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.core import signing
+from django.urls import reverse
+from django.utils import timezone
+from .backup_diff import compare_backups
+from .bulk import BULK_ACTIONS, run_bulk_operation
+from .backup_engine import MSSQLNativeBackup, MSSQLStreamBackup, SegmentWriter, SpillBuffer
+from .backup_reader import BackupReader, LegacyTableStream
+from .compression import zstd_available
+from .discovery import database_cache_key
+from .scheduling import choose_queue, estimate_job, get_job_history, plan_server_backup, predict_queue_eta
+from .views import TASK_STATUS_SALT
+from .models import BackupJob, BulkOperation, BulkOperationResult, SQLServer
+from .storage import LocalStorage, S3MultipartWriter, S3Storage
+from .heartbeat import JobHeartbeat
+from .tasks import backup_database_task, reap_stale_jobs
+import gzip
+import io
+import json
+import shutil
+import tempfile
+import threading
+import time
+import unittest
 
-# Create your tests here.
+
+class FakeConnection:
+    """Stand-in for a pyodbc connection that hands out one cursor"""
+    
+    def __init__(self, cursor):
+        self.cursor_obj = cursor
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *args):
+        return False
+    
+    def cursor(self):
+        return self.cursor_obj
+
+
+class FakeNativeCursor:
+    """Answers the queries MSSQLNativeBackup runs, recording every statement.
+    
+    The BACKUP statement blocks until progress has been polled once, so the
+    polling loop is always exercised.
+    """
+    
+    def __init__(self, progress_polled, percent=50.0, sizes=(1234, 5678)):
+        self.progress_polled = progress_polled
+        self.percent = percent
+        self.sizes = sizes
+        self.executed = []
+        self.row = None
+    
+    def execute(self, sql, *params):
+        self.executed.append((sql, params))
+        if sql == "SELECT @@SPID":
+            self.row = (55,)
+        elif sql.startswith('BACKUP DATABASE'):
+            self.progress_polled.wait(5)
+            self.row = None
+        elif sql == MSSQLNativeBackup.PROGRESS_QUERY:
+            self.row = (self.percent,)
+            self.progress_polled.set()
+        elif sql == MSSQLNativeBackup.BACKUP_SIZE_QUERY:
+            self.row = self.sizes
+    
+    def fetchone(self):
+        return self.row
+    
+    def nextset(self):
+        return False
+
+
+class StubbedNativeBackup(MSSQLNativeBackup):
+    """Native engine whose connections all go to fake cursors"""
+    
+    def __init__(self, server_config, cursor=None):
+        super().__init__(server_config, poll_interval=0.01)
+        self.cursor = cursor
+        self.connect_kwargs = []
+    
+    def connect(self, database_name='master', **kwargs):
+        self.connect_kwargs.append(kwargs)
+        return FakeConnection(self.cursor)
+
+
+def native_config(**overrides):
+    config = {
+        'name': 'srv',
+        'server_address': 'sql.example.com',
+        'port': 1433,
+        'username': 'backup',
+        'password': 'secret',
+        'backup_mode': 'native',
+        'native_backup_dir': r'D:\Backups',
+        'stripe_count': 1,
+        'max_transfer_size': None,
+        'buffer_count': None,
+    }
+    config.update(overrides)
+    return config
+
+
+class NativeBackupSQLTests(SimpleTestCase):
+    def test_quotes_database_name_and_paths(self):
+        engine = StubbedNativeBackup(native_config(native_backup_dir="/var/opt/o'brien"))
+        sql = engine.build_backup_sql('Sales]Db', ["/var/opt/o'brien/a.bak"])
+        
+        self.assertTrue(sql.startswith("BACKUP DATABASE [Sales]]Db] "))
+        self.assertIn("DISK = N'/var/opt/o''brien/a.bak'", sql)
+        self.assertIn("WITH COMPRESSION, CHECKSUM, INIT, STATS = 5", sql)
+    
+    def test_transfer_options_only_when_set(self):
+        engine = StubbedNativeBackup(native_config())
+        sql = engine.build_backup_sql('db', [r'D:\Backups\db.bak'])
+        self.assertNotIn('MAXTRANSFERSIZE', sql)
+        self.assertNotIn('BUFFERCOUNT', sql)
+        
+        engine = StubbedNativeBackup(native_config(max_transfer_size=4194304, buffer_count=64))
+        sql = engine.build_backup_sql('db', [r'D:\Backups\db.bak'])
+        self.assertTrue(sql.endswith("STATS = 5, MAXTRANSFERSIZE = 4194304, BUFFERCOUNT = 64"))
+    
+    def test_stripes_every_file_into_one_statement(self):
+        engine = StubbedNativeBackup(native_config())
+        sql = engine.build_backup_sql('db', ['/b/1.bak', '/b/2.bak'])
+        self.assertIn("TO DISK = N'/b/1.bak', DISK = N'/b/2.bak' WITH", sql)
+
+
+class NativeStripeFileTests(SimpleTestCase):
+    def test_single_file(self):
+        engine = StubbedNativeBackup(native_config())
+        self.assertEqual(
+            engine.get_stripe_files('db', '20240101_000000'),
+            [r'D:\Backups\db_20240101_000000.bak'],
+        )
+    
+    def test_numbered_stripes(self):
+        engine = StubbedNativeBackup(native_config(stripe_count=3))
+        self.assertEqual(engine.get_stripe_files('db', 'ts'), [
+            r'D:\Backups\db_ts_1of3.bak',
+            r'D:\Backups\db_ts_2of3.bak',
+            r'D:\Backups\db_ts_3of3.bak',
+        ])
+    
+    def test_linux_and_windows_separators(self):
+        engine = StubbedNativeBackup(native_config(native_backup_dir='/var/opt/mssql/backup/'))
+        self.assertEqual(engine.get_stripe_files('db', 'ts'), ['/var/opt/mssql/backup/db_ts.bak'])
+        
+        engine = StubbedNativeBackup(native_config(native_backup_dir='E:'))
+        self.assertEqual(engine.get_stripe_files('db', 'ts'), [r'E:\db_ts.bak'])
+        
+        engine = StubbedNativeBackup(native_config(native_backup_dir=r'\\fileserver\backups\\'))
+        self.assertEqual(engine.get_stripe_files('db', 'ts'), [r'\\fileserver\backups\db_ts.bak'])
+    
+    def test_requires_backup_dir(self):
+        engine = StubbedNativeBackup(native_config(native_backup_dir=''))
+        with self.assertRaises(ValueError):
+            engine.get_stripe_files('db', 'ts')
+
+
+class NativeBackupRunTests(SimpleTestCase):
+    def test_runs_backup_polls_progress_and_reads_size(self):
+        cursor = FakeNativeCursor(threading.Event())
+        engine = StubbedNativeBackup(native_config(stripe_count=2), cursor)
+        messages = []
+        
+        backup_path, total_size = engine.backup_database('db', progress_callback=messages.append)
+        
+        statements = [sql for sql, _ in cursor.executed]
+        backup_sql = next(sql for sql in statements if sql.startswith('BACKUP DATABASE'))
+        self.assertIn('_1of2.bak', backup_sql)
+        self.assertIn('_2of2.bak', backup_sql)
+        self.assertIn((MSSQLNativeBackup.PROGRESS_QUERY, (55,)), cursor.executed)
+        self.assertIn("Native backup 50.0% complete", messages)
+        self.assertEqual(total_size, 1234)
+        
+        files = backup_path.split(';')
+        self.assertEqual(len(files), 2)
+        size_params = next(params for sql, params in cursor.executed if sql == MSSQLNativeBackup.BACKUP_SIZE_QUERY)
+        self.assertEqual(size_params, ('db', files[0]))
+        # BACKUP can't run inside a transaction
+        self.assertEqual(engine.connect_kwargs[0], {'autocommit': True})
+    
+    def test_falls_back_to_uncompressed_size(self):
+        cursor = FakeNativeCursor(threading.Event(), sizes=(None, 5678))
+        engine = StubbedNativeBackup(native_config(), cursor)
+        _, total_size = engine.backup_database('db')
+        self.assertEqual(total_size, 5678)
+    
+    def test_backup_error_is_raised(self):
+        class FailingCursor(FakeNativeCursor):
+            def execute(self, sql, *params):
+                if sql.startswith('BACKUP DATABASE'):
+                    raise RuntimeError("Cannot open backup device")
+                super().execute(sql, *params)
+        
+        engine = StubbedNativeBackup(native_config(), FailingCursor(threading.Event()))
+        with self.assertRaisesMessage(RuntimeError, "Cannot open backup device"):
+            engine.backup_database('db')
+
+
+TableRow = namedtuple('TableRow', ['TABLE_SCHEMA', 'TABLE_NAME'])
+
+
+class FakeTableCursor:
+    """Serves INFORMATION_SCHEMA.TABLES and SELECT * queries from in-memory tables"""
+    
+    def __init__(self, tables):
+        self.tables = tables
+        self.rows = []
+        self.description = None
+    
+    def execute(self, sql, *params):
+        if 'INFORMATION_SCHEMA.TABLES' in sql:
+            self.rows = [TableRow(schema_name, table_name) for schema_name, table_name in self.tables]
+            return
+        full_table_name = sql.split(' FROM ')[1].split()[0]
+        schema_name, table_name = full_table_name.strip('[]').split('].[')
+        columns, rows = self.tables[(schema_name, table_name)]
+        self.description = [(column,) for column in columns]
+        self.rows = [] if 'WHERE 1=0' in sql else list(rows)
+    
+    def fetchall(self):
+        rows, self.rows = self.rows, []
+        return rows
+    
+    def fetchmany(self, size):
+        rows, self.rows = self.rows[:size], self.rows[size:]
+        return rows
+
+
+class StubbedStreamBackup(MSSQLStreamBackup):
+    def __init__(self, tables, storage):
+        super().__init__({'name': 'srv'}, storage=storage)
+        self.tables = tables
+    
+    def connect(self, database_name='master', **kwargs):
+        return FakeConnection(FakeTableCursor(self.tables))
+
+
+def make_table(row_count, width=1):
+    return ['id', 'name'], [(i, f"row-{i}-" + 'x' * width) for i in range(row_count)]
+
+
+class StorageTestCase(SimpleTestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+        self.storage = LocalStorage(self.root)
+    
+    def run_backup(self, tables, **kwargs):
+        engine = StubbedStreamBackup(tables, self.storage)
+        location, _ = engine.backup_database('db', include_schema=False, **kwargs)
+        return BackupReader(location)
+
+
+@override_settings(BACKUP_BLOCK_ROWS=10)
+class BlockFormatTests(StorageTestCase):
+    def test_block_index(self):
+        reader = self.run_backup({('dbo', 'items'): make_table(35)}, layout='dedicated')
+        index = reader.get_table_index('dbo', 'items')
+        
+        self.assertEqual(index['row_count'], 35)
+        self.assertEqual([block['row_start'] for block in index['blocks']], [0, 10, 20, 30])
+        self.assertEqual([block['rows'] for block in index['blocks']], [10, 10, 10, 5])
+        offsets = [block['offset'] for block in index['blocks']]
+        lengths = [block['length'] for block in index['blocks']]
+        self.assertEqual(offsets, [sum(lengths[:i]) for i in range(4)])
+    
+    def test_reads_across_block_boundaries(self):
+        reader = self.run_backup({('dbo', 'items'): make_table(35)}, layout='dedicated')
+        ids = lambda rows: [int(row['id']) for row in rows]
+        
+        self.assertEqual(ids(reader.read_rows('dbo', 'items', 0, 10)), list(range(10)))
+        self.assertEqual(ids(reader.read_rows('dbo', 'items', 9, 2)), [9, 10])
+        self.assertEqual(ids(reader.read_rows('dbo', 'items', 10, 10)), list(range(10, 20)))
+        self.assertEqual(ids(reader.read_rows('dbo', 'items', 19, 12)), list(range(19, 31)))
+        self.assertEqual(ids(reader.read_rows('dbo', 'items', 30, 10)), list(range(30, 35)))
+        self.assertEqual(reader.read_rows('dbo', 'items', 35, 10), [])
+        self.assertEqual(ids(reader.iter_rows('dbo', 'items')), list(range(35)))
+    
+    def test_empty_table(self):
+        reader = self.run_backup({('dbo', 'empty'): make_table(0)}, layout='dedicated')
+        self.assertEqual(reader.get_row_count('dbo', 'empty'), 0)
+        self.assertEqual(reader.read_rows('dbo', 'empty', 0, 10), [])
+        self.assertEqual(reader.verify(), [])
+    
+    def test_gzip_table_file_is_one_gzip_stream(self):
+        reader = self.run_backup({('dbo', 'items'): make_table(25)}, layout='dedicated')
+        data = gzip.decompress(reader.storage.read_bytes('dbo_items.json.gz'))
+        rows = [json.loads(line) for line in data.decode('utf-8').splitlines()]
+        self.assertEqual([row['id'] for row in rows], [str(i) for i in range(25)])
+    
+    def test_verify_reports_row_count_mismatch(self):
+        reader = self.run_backup({('dbo', 'items'): make_table(15)}, layout='dedicated')
+        self.assertEqual(reader.verify(), [])
+        
+        manifest = reader.get_manifest()
+        manifest['tables'][0]['rows'] = 16
+        reader.storage.write_bytes('backup_manifest.json', json.dumps(manifest).encode('utf-8'))
+        problems = BackupReader(reader.storage).verify()
+        self.assertEqual(problems, [('dbo', 'items', 'expected 16 rows, decoded 15')])
+    
+    def test_verify_reports_corrupt_block(self):
+        reader = self.run_backup({('dbo', 'items'): make_table(15)}, layout='dedicated')
+        path = reader.storage.path('dbo_items.json.gz')
+        data = bytearray(path.read_bytes())
+        data[-12:-8] = b'\0\0\0\0'
+        path.write_bytes(bytes(data))
+        
+        problems = BackupReader(reader.storage).verify()
+        self.assertEqual(len(problems), 1)
+        self.assertEqual(problems[0][:2], ('dbo', 'items'))
+
+
+@override_settings(BACKUP_BLOCK_ROWS=10, BACKUP_PACK_THRESHOLD=600, BACKUP_SEGMENT_SIZE=300)
+class PackedLayoutTests(StorageTestCase):
+    def test_small_tables_are_packed_and_large_tables_spill(self):
+        tables = {('dbo', f'small{i}'): make_table(5) for i in range(6)}
+        tables[('dbo', 'large')] = make_table(200, width=50)
+        reader = self.run_backup(tables, layout='packed')
+        manifest = reader.get_manifest()
+        
+        large = reader.get_table_entry('dbo', 'large')
+        self.assertEqual(large['file'], 'dbo_large.json.gz')
+        self.assertNotIn('segment', large)
+        
+        small = [reader.get_table_entry('dbo', f'small{i}') for i in range(6)]
+        self.assertTrue(all('segment' in entry and 'inline_index' in entry for entry in small))
+        self.assertGreater(manifest['segments_count'], 1)
+        self.assertEqual(manifest['segments_count'], len({entry['segment'] for entry in small}))
+        self.assertFalse(reader.storage.exists('dbo_small0.json.gz'))
+        
+        for i in range(6):
+            self.assertEqual([row['id'] for row in reader.read_rows('dbo', f'small{i}', 0, 10)], [str(n) for n in range(5)])
+        self.assertEqual(reader.read_rows('dbo', 'large', 195, 10)[0]['id'], '195')
+        self.assertEqual(reader.verify(), [])
+    
+    def test_packed_is_the_default_layout(self):
+        with self.settings():
+            del settings.BACKUP_LAYOUT
+            reader = self.run_backup({('dbo', 'small'): make_table(5)})
+        self.assertIn('segment', reader.get_table_entry('dbo', 'small'))
+
+
+@unittest.skipUnless(zstd_available(), "zstandard is not installed")
+@override_settings(BACKUP_BLOCK_ROWS=10, BACKUP_PACK_THRESHOLD=1000, BACKUP_ZSTD_DICTIONARY=True, BACKUP_ZSTD_DICT_SIZE=4096)
+class DictionaryCompressionTests(StorageTestCase):
+    def test_dictionary_coded_tables_are_named_and_recorded_as_zstd(self):
+        tables = {
+            ('dbo', f'lookup{i}'): (['code', 'label', 'status'], [(n, f'label {n % 7}', 'ACTIVE') for n in range(20)])
+            for i in range(30)
+        }
+        tables[('dbo', 'large')] = make_table(300, width=2000)
+        engine = StubbedStreamBackup(tables, self.storage)
+        previous, _ = engine.backup_database('db', include_schema=False, layout='dedicated')
+        time.sleep(1)
+        location, _ = engine.backup_database('db', include_schema=False, layout='dedicated', dictionary_source=previous)
+        reader = BackupReader(location)
+        
+        lookup = reader.get_table_entry('dbo', 'lookup0')
+        self.assertEqual(lookup['file'], 'dbo_lookup0.json.zst')
+        self.assertEqual(lookup['index'], 'dbo_lookup0.index.json')
+        self.assertEqual(lookup['codec'], 'zstd')
+        large = reader.get_table_entry('dbo', 'large')
+        self.assertEqual((large['file'], large['codec']), ('dbo_large.json.gz', 'gzip'))
+        
+        self.assertEqual(reader.read_rows('dbo', 'lookup0', 18, 5)[0]['code'], '18')
+        self.assertEqual(reader.verify(), [])
+
+class SegmentWriterTests(StorageTestCase):
+    def test_rolls_over_when_segment_is_full(self):
+        segments = SegmentWriter(self.storage, 'backup', segment_size=10)
+        placements = [segments.append(data) for data in (b'aaaa', b'bbbb', b'cccc', b'dddddddddddd', b'e')]
+        segments.close()
+        
+        self.assertEqual(placements, [
+            ('segment_0001.dat', 0),
+            ('segment_0001.dat', 4),
+            ('segment_0002.dat', 0),
+            ('segment_0003.dat', 0),
+            ('segment_0004.dat', 0),
+        ])
+        self.assertEqual(self.storage.read_bytes('backup/segment_0001.dat'), b'aaaabbbb')
+        # An item larger than a segment gets a segment of its own
+        self.assertEqual(self.storage.read_bytes('backup/segment_0003.dat'), b'dddddddddddd')
+        self.assertEqual(segments.segment_number, 4)
+        self.assertEqual(segments.total_size, 25)
+
+
+class SpillBufferTests(StorageTestCase):
+    def test_stays_in_memory_up_to_threshold(self):
+        buffer = SpillBuffer(self.storage, 'table.json.gz', threshold=8)
+        buffer.write(b'1234')
+        buffer.write(b'5678')
+        buffer.close()
+        
+        self.assertFalse(buffer.spilled)
+        self.assertEqual(buffer.getvalue(), b'12345678')
+        self.assertFalse(self.storage.exists('table.json.gz'))
+    
+    def test_spills_everything_once_past_threshold(self):
+        buffer = SpillBuffer(self.storage, 'table.json.gz', threshold=8)
+        buffer.write(b'1234')
+        buffer.write(b'56789')
+        buffer.write(b'abc')
+        buffer.close()
+        
+        self.assertTrue(buffer.spilled)
+        self.assertEqual(self.storage.read_bytes('table.json.gz'), b'123456789abc')
+
+
+def legacy_table_text(rows, columns=('id', 'name')):
+    """A table file body as written before block compression, rows streamed into one JSON object"""
+    return (
+        '{"database":"db","schema":"dbo","table":"old","columns":' + json.dumps(list(columns))
+        + ',"backup_timestamp":"2024-01-01T00:00:00","data":['
+        + ','.join(json.dumps(row) for row in rows) + ']}'
+    )
+
+
+class LegacyFormatTests(StorageTestCase):
+    def write_legacy_table(self, text):
+        self.storage.write_bytes('dbo_old.json.gz', gzip.compress(text.encode('utf-8')))
+        self.storage.write_bytes('backup_manifest.json', json.dumps({
+            'database': 'db',
+            'tables': [{'schema': 'dbo', 'table': 'old'}],
+        }).encode('utf-8'))
+        return BackupReader(self.storage)
+    
+    def test_stream_parser_matches_json_load_across_chunk_boundaries(self):
+        rows = [
+            {'id': '1', 'name': 'plain'},
+            {'id': '2', 'name': 'brackets ]} and "quotes", commas'},
+            {'id': '3', 'name': None, 'amount': 12345.678e-3, 'nested': [1, {'a': []}]},
+            {'id': '4', 'name': 'unicode \u00e9 \\ escapes'},
+        ]
+        text = legacy_table_text(rows)
+        for chunk_size in (1, 2, 7, 64 * 1024):
+            items = list(LegacyTableStream(io.StringIO(text), chunk_size=chunk_size))
+            self.assertEqual([value for key, value in items if key == 'data'], json.loads(text)['data'])
+            self.assertEqual(dict(items[:5])['columns'], ['id', 'name'])
+        
+        empty = list(LegacyTableStream(io.StringIO(legacy_table_text([]))))
+        self.assertEqual([key for key, _ in empty], ['database', 'schema', 'table', 'columns', 'backup_timestamp'])
+        with self.assertRaises(ValueError):
+            list(LegacyTableStream(io.StringIO(text[:-10])))
+    
+    def test_partial_reads_stop_after_the_requested_rows(self):
+        # A file cut off mid-table: anything that reads to the end fails
+        text = legacy_table_text([{'id': str(i), 'name': f'n{i}'} for i in range(50)])
+        reader = self.write_legacy_table(text[:len(text) // 2])
+        
+        self.assertEqual(reader.get_columns('dbo', 'old'), ['id', 'name'])
+        self.assertEqual([row['id'] for row in reader.read_rows('dbo', 'old', 3, 4)], ['3', '4', '5', '6'])
+        with self.assertRaises(ValueError):
+            reader.get_row_count('dbo', 'old')
+    
+    def test_reads_single_stream_table_files(self):
+        table = {'columns': ['id', 'name'], 'data': [{'id': str(i), 'name': f'n{i}'} for i in range(7)]}
+        buffer = io.BytesIO()
+        with gzip.open(buffer, 'wt', encoding='utf-8') as f:
+            json.dump(table, f)
+        self.storage.write_bytes('dbo_old.json.gz', buffer.getvalue())
+        self.storage.write_bytes('backup_manifest.json', json.dumps({
+            'database': 'db',
+            'tables': [{'schema': 'dbo', 'table': 'old', 'file': 'dbo_old.json.gz'}],
+        }).encode('utf-8'))
+        
+        reader = BackupReader(self.storage)
+        self.assertIsNone(reader.get_table_index('dbo', 'old'))
+        self.assertEqual(reader.get_columns('dbo', 'old'), ['id', 'name'])
+        self.assertEqual(reader.get_row_count('dbo', 'old'), 7)
+        self.assertEqual(reader.read_rows('dbo', 'old', 5, 10), table['data'][5:])
+        self.assertEqual(reader.verify(), [])
+
+
+@override_settings(BACKUP_BLOCK_ROWS=10)
+class CompareBackupsTests(SimpleTestCase):
+    def backup(self, tables):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root, ignore_errors=True)
+        location, _ = StubbedStreamBackup(tables, LocalStorage(root)).backup_database('db', include_schema=False)
+        return BackupReader(location)
+    
+    def legacy_backup(self, rows):
+        storage = LocalStorage(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, storage.root, ignore_errors=True)
+        table = {'columns': ['id', 'name'], 'data': [{'id': str(i), 'name': name} for i, name in rows]}
+        storage.write_bytes('dbo_items.json.gz', gzip.compress(json.dumps(table).encode('utf-8')))
+        storage.write_bytes('backup_manifest.json', json.dumps({
+            'database': 'db',
+            'tables': [{'schema': 'dbo', 'table': 'items', 'file': 'dbo_items.json.gz'}],
+        }).encode('utf-8'))
+        return BackupReader(storage)
+    
+    def test_block_hashes_locate_changed_rows(self):
+        columns, rows = make_table(35)
+        old = self.backup({('dbo', 'items'): (columns, rows)})
+        rows[12] = (12, 'edited')
+        new = self.backup({('dbo', 'items'): (columns, rows)})
+        
+        result = compare_backups(old, new, decode=False)['tables'][0]
+        self.assertEqual(result['status'], 'changed')
+        self.assertEqual(result['method'], 'block_hash')
+        self.assertEqual(result['changed_ranges'], [[10, 20]])
+        self.assertEqual(result['blocks_decoded'], 0)
+    
+    def test_tables_needing_decode_are_skipped_unless_allowed(self):
+        columns, rows = make_table(5)
+        old = self.legacy_backup(rows)
+        rows[3] = (3, 'edited')
+        new = self.backup({('dbo', 'items'): (columns, rows)})
+        
+        legacy_reads = mock.patch.object(
+            BackupReader, '_iter_legacy_table', autospec=True, side_effect=BackupReader._iter_legacy_table,
+        )
+        with legacy_reads as read_legacy:
+            diff = compare_backups(old, new, decode=False)
+        read_legacy.assert_not_called()
+        self.assertEqual(diff['tables'][0]['status'], 'skipped')
+        self.assertEqual(diff['summary']['skipped'], 1)
+        
+        with legacy_reads as read_legacy:
+            result = compare_backups(old, new)['tables'][0]
+        read_legacy.assert_called()
+        self.assertEqual(result['status'], 'changed')
+        self.assertEqual(result['method'], 'rows')
+        self.assertEqual(result['changed_ranges'], [[3, 4]])
+
+
+class JobCompareViewTests(TestCase):
+    def setUp(self):
+        self.server = SQLServer.objects.create(name='srv', server_address='sql', username='u', password='p', databases='["db"]')
+    
+    def make_job(self, database_name, completed_at):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root, ignore_errors=True)
+        location, size = StubbedStreamBackup({('dbo', 'items'): make_table(5)}, LocalStorage(root)).backup_database(
+            database_name, include_schema=False,
+        )
+        return BackupJob.objects.create(
+            server=self.server, database_name=database_name, status='completed',
+            backup_path=location, file_size=size, completed_at=completed_at,
+        )
+    
+    def test_compares_only_backups_of_the_same_database(self):
+        now = timezone.now()
+        old = self.make_job('db', now - timedelta(days=1))
+        new = self.make_job('db', now)
+        other = self.make_job('other', now - timedelta(hours=1))
+        url = reverse('job_compare', args=[new.id])
+        
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['old_job'], old)
+        self.assertEqual(response.context['summary']['unchanged'], 1)
+        
+        self.assertEqual(self.client.get(url, {'other': old.id}).status_code, 200)
+        self.assertEqual(self.client.get(url, {'other': other.id}).status_code, 404)
+
+
+class TablePreviewViewTests(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+        self.server = SQLServer.objects.create(name='srv', server_address='sql', username='u', password='p', databases='["db"]')
+    
+    def preview(self, location, **params):
+        job = BackupJob.objects.create(server=self.server, database_name='db', status='completed', backup_path=location)
+        return self.client.get(reverse('job_table_preview', args=[job.id]), {'schema': 'dbo', 'table': 'old', **params})
+    
+    @override_settings(TABLE_PREVIEW_ROWS=10)
+    def test_legacy_table_pages_without_reading_the_whole_file(self):
+        storage = LocalStorage(self.root)
+        text = legacy_table_text([{'id': str(i), 'name': f'n{i}'} for i in range(200)])
+        storage.write_bytes('dbo_old.json.gz', gzip.compress(text[:len(text) // 2].encode('utf-8')))
+        storage.write_bytes('backup_manifest.json', json.dumps({
+            'database': 'db',
+            'tables': [{'schema': 'dbo', 'table': 'old'}],
+        }).encode('utf-8'))
+        
+        response = self.preview(self.root, start=20)
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.context['row_count'])
+        self.assertEqual([row[0] for row in response.context['rows']], [str(i) for i in range(20, 30)])
+        self.assertEqual(response.context['next_start'], 30)
+    
+    @override_settings(TABLE_PREVIEW_ROWS=10)
+    def test_block_table_shows_row_count_and_last_page(self):
+        engine = StubbedStreamBackup({('dbo', 'old'): make_table(25)}, LocalStorage(self.root))
+        location, _ = engine.backup_database('db', include_schema=False)
+        
+        response = self.preview(location, start=20)
+        self.assertEqual(response.context['row_count'], 25)
+        self.assertEqual(len(response.context['rows']), 5)
+        self.assertIsNone(response.context['next_start'])
+
+
+class TableExportViewTests(TestCase):
+    def setUp(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root, ignore_errors=True)
+        rows = [(i, f'value {i}') for i in range(5)]
+        engine = StubbedStreamBackup({('dbo', 'items'): (['id', 'total, net'], rows)}, LocalStorage(root))
+        location, size = engine.backup_database('db', include_schema=False)
+        server = SQLServer.objects.create(name='srv', server_address='sql', username='u', password='p', databases='["db"]')
+        self.job = BackupJob.objects.create(
+            server=server, database_name='db', status='completed', backup_path=location, file_size=size,
+        )
+        self.url = reverse('job_table_export', args=[self.job.id])
+    
+    def export(self, **params):
+        response = self.client.get(self.url, {'schema': 'dbo', 'table': 'items', **params})
+        if response.status_code != 200:
+            return response, None
+        return response, b''.join(response.streaming_content).decode('utf-8')
+    
+    def test_column_names_containing_commas(self):
+        response, body = self.export(format='ndjson', columns=['total, net'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(body.splitlines()[0]), {'total, net': 'value 0'})
+        
+        response, _ = self.export(format='csv', columns=['total', ' net'])
+        self.assertEqual(response.status_code, 400)
+    
+    def test_limit(self):
+        _, body = self.export(format='csv', limit=2)
+        self.assertEqual(len(body.splitlines()), 3)
+        
+        response, _ = self.export(format='csv', limit=-1)
+        self.assertEqual(response.status_code, 400)
+    
+    def legacy_export(self, text, **params):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root, ignore_errors=True)
+        storage = LocalStorage(root)
+        storage.write_bytes('dbo_old.json.gz', gzip.compress(text.encode('utf-8')))
+        storage.write_bytes('backup_manifest.json', json.dumps({
+            'database': 'db',
+            'tables': [{'schema': 'dbo', 'table': 'old'}],
+        }).encode('utf-8'))
+        job = BackupJob.objects.create(server=self.job.server, database_name='db', status='completed', backup_path=root)
+        response = self.client.get(reverse('job_table_export', args=[job.id]), {'schema': 'dbo', 'table': 'old', **params})
+        return b''.join(response.streaming_content).decode('utf-8')
+    
+    def test_legacy_table_is_streamed(self):
+        rows = [{'id': str(i), 'name': f'n{i}'} for i in range(100)]
+        text = legacy_table_text(rows)
+        with mock.patch('json.load', side_effect=AssertionError("legacy table loaded whole")):
+            body = self.legacy_export(text, format='ndjson')
+        self.assertEqual([json.loads(line) for line in body.splitlines()], rows)
+        
+        # Only the rows up to the limit are read: a truncated file still exports
+        body = self.legacy_export(text[:len(text) // 2], format='csv', limit=5)
+        self.assertEqual(body.splitlines(), ['id,name'] + [f'{i},n{i}' for i in range(5)])
+
+
+@override_settings(
+    BACKUP_HISTORY_SAMPLE=3,
+    BACKUP_DEFAULT_ESTIMATE_SECONDS=300,
+    BACKUP_LARGE_JOB_SECONDS=1800,
+    BACKUP_LARGE_JOB_BYTES=1000,
+    BACKUP_SMALL_QUEUE='small',
+    BACKUP_LARGE_QUEUE='large',
+)
+class SchedulingTests(TestCase):
+    def setUp(self):
+        self.server = SQLServer.objects.create(name='srv', server_address='sql', username='u', password='p', databases='[]')
+        self.now = timezone.now()
+    
+    def add_history(self, database_name, durations, file_size=100):
+        """Completed jobs, oldest first, taking the given number of seconds each"""
+        for i, duration in enumerate(durations):
+            completed_at = self.now - timedelta(days=len(durations) - i)
+            BackupJob.objects.create(
+                server=self.server, database_name=database_name, status='completed', file_size=file_size,
+                started_at=completed_at - timedelta(seconds=duration), completed_at=completed_at,
+            )
+    
+    def test_history_keeps_the_latest_jobs_per_database(self):
+        self.add_history('busy', [10, 20, 30, 40, 50])
+        self.add_history('rare', [7])
+        BackupJob.objects.create(server=self.server, database_name='busy', status='failed',
+                                 started_at=self.now, completed_at=self.now)
+        
+        with self.assertNumQueries(1):
+            history = get_job_history(self.server, ['busy', 'rare', 'new'])
+        self.assertEqual(history['busy'], [(50.0, 100), (40.0, 100), (30.0, 100)])
+        self.assertEqual(history['rare'], [(7.0, 100)])
+        self.assertNotIn('new', history)
+    
+    def test_estimate_and_queue(self):
+        self.assertEqual(estimate_job([]), (300, None))
+        self.assertEqual(estimate_job([(10.0, 100), (20.0, 301)]), (15.0, 200))
+        
+        self.assertEqual(choose_queue(60, 10), 'small')
+        self.assertEqual(choose_queue(60, None), 'small')
+        self.assertEqual(choose_queue(1800, 10), 'large')
+        self.assertEqual(choose_queue(60, 1000), 'large')
+    
+    def test_plan_orders_dispatch(self):
+        self.add_history('quick', [10, 20])
+        self.add_history('slow', [3600])
+        self.add_history('big', [100], file_size=5000)
+        databases = ['slow', 'quick', 'big', 'new']
+        
+        with self.settings(BACKUP_DISPATCH_ORDER='shortest_first'):
+            plan = plan_server_backup(self.server, databases)
+        self.assertEqual([item['database_name'] for item in plan], ['quick', 'big', 'new', 'slow'])
+        self.assertEqual({item['database_name']: item['queue'] for item in plan},
+                         {'quick': 'small', 'big': 'large', 'new': 'small', 'slow': 'large'})
+        self.assertEqual(plan[0]['estimated_duration'], 15.0)
+        
+        with self.settings(BACKUP_DISPATCH_ORDER='longest_first'):
+            plan = plan_server_backup(self.server, databases)
+        self.assertEqual([item['database_name'] for item in plan], ['slow', 'new', 'big', 'quick'])
+    
+    @override_settings(BACKUP_QUEUE_WORKERS={'small': 2, 'large': 1})
+    def test_queue_eta(self):
+        self.assertIsNone(predict_queue_eta(self.now))
+        
+        for duration in (100, 300):
+            BackupJob.objects.create(server=self.server, database_name='a', status='pending',
+                                     queue='small', estimated_duration=duration)
+        BackupJob.objects.create(server=self.server, database_name='b', status='running', queue='large',
+                                 estimated_duration=500, started_at=self.now - timedelta(seconds=200))
+        BackupJob.objects.create(server=self.server, database_name='c', status='completed', queue='large',
+                                 estimated_duration=10000)
+        
+        eta = predict_queue_eta(self.now)
+        self.assertEqual(eta['per_queue'], {'small': 200.0, 'large': 300.0})
+        self.assertEqual(eta['remaining_seconds'], 300.0)
+        self.assertEqual(eta['eta'], self.now + timedelta(seconds=300))
+
+
+@override_settings(BACKUP_HEARTBEAT_INTERVAL=30, BACKUP_HEARTBEAT_TIMEOUT=150, BACKUP_MAX_ATTEMPTS=3)
+class ReapStaleJobTests(TestCase):
+    def setUp(self):
+        self.server = SQLServer.objects.create(name='srv', server_address='sql', username='u', password='p', databases='[]')
+    
+    def make_job(self, heartbeat_age, **fields):
+        heartbeat_at = timezone.now() - timedelta(seconds=heartbeat_age)
+        fields = {'status': 'running', 'worker_hostname': 'worker-1', 'attempts': 1, **fields}
+        return BackupJob.objects.create(
+            server=self.server, database_name='db', started_at=heartbeat_at, heartbeat_at=heartbeat_at, **fields
+        )
+    
+    def reap(self, live_workers=None, revoke=None):
+        with mock.patch('backup_app.tasks.get_live_workers', return_value=live_workers), \
+                mock.patch('celery.current_app.control.revoke', side_effect=revoke), \
+                mock.patch.object(backup_database_task, 'apply_async', return_value=mock.Mock(id='new-task')) as apply_async:
+            return reap_stale_jobs(), apply_async
+    
+    def test_requeues_stale_job_on_its_queue_until_attempts_run_out(self):
+        stale = self.make_job(600, queue='backups_large', task_id='dead-task')
+        spent = self.make_job(600, queue='backups_large', attempts=3)
+        
+        result, apply_async = self.reap()
+        self.assertEqual(result['requeued'], [stale.id])
+        self.assertEqual(result['failed'], [spent.id])
+        apply_async.assert_called_once_with(args=[stale.id], queue='backups_large')
+        
+        stale.refresh_from_db()
+        self.assertEqual((stale.status, stale.task_id, stale.heartbeat_at), ('pending', 'new-task', None))
+        self.assertIn('worker-1', stale.error_message)
+        spent.refresh_from_db()
+        self.assertEqual(spent.status, 'failed')
+        self.assertIsNotNone(spent.completed_at)
+    
+    def test_leaves_live_jobs_alone(self):
+        recent = self.make_job(10)
+        quiet = self.make_job(90, worker_hostname='worker-2')
+        
+        result, apply_async = self.reap(live_workers={'worker-2'})
+        self.assertEqual(result, {'requeued': [], 'failed': [], 'failed_operations': []})
+        apply_async.assert_not_called()
+        for job in (recent, quiet):
+            job.refresh_from_db()
+            self.assertEqual(job.status, 'running')
+    
+    def test_heartbeat_after_the_check_stops_the_claim(self):
+        job = self.make_job(600, task_id='wedged-task')
+        
+        def late_heartbeat(task_id, terminate):
+            BackupJob.objects.filter(pk=job.pk).update(heartbeat_at=timezone.now())
+        
+        result, apply_async = self.reap(revoke=late_heartbeat)
+        self.assertEqual(result['requeued'], [])
+        apply_async.assert_not_called()
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'running')
+    
+    def test_heartbeat_only_stamps_running_jobs(self):
+        running = self.make_job(600)
+        finished = self.make_job(600, status='completed')
+        for job in (running, finished):
+            heartbeat = JobHeartbeat(job.id)
+            heartbeat.stopped.wait = mock.Mock(side_effect=[False, True])
+            with mock.patch('backup_app.heartbeat.connection'):
+                heartbeat.run()
+        
+        old = finished.heartbeat_at
+        running.refresh_from_db()
+        finished.refresh_from_db()
+        self.assertGreater(running.heartbeat_at, timezone.now() - timedelta(seconds=5))
+        self.assertEqual(finished.heartbeat_at, old)
+    
+    def test_requeued_job_clears_the_reap_reason_when_it_starts(self):
+        job = self.make_job(600, status='pending', error_message='Worker worker-1 stopped responding')
+        engine = mock.Mock()
+        engine.backup_database.return_value = ('/backups/db', 123)
+        with mock.patch('backup_app.tasks.get_backup_engine', return_value=engine), \
+                mock.patch('backup_app.tasks.JobHeartbeat'):
+            backup_database_task.apply(args=[job.id])
+        
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.error_message, job.attempts), ('completed', '', 2))
+
+
+@override_settings(BACKUP_HEARTBEAT_INTERVAL=30, BACKUP_HEARTBEAT_TIMEOUT=150)
+class ReapStaleBulkOperationTests(TestCase):
+    def reap(self, live_workers=None):
+        with mock.patch('backup_app.tasks.get_live_workers', return_value=live_workers), \
+                mock.patch('celery.current_app.control.revoke') as revoke:
+            return reap_stale_jobs(), revoke
+    
+    def make_operation(self, heartbeat_age, **fields):
+        heartbeat_at = timezone.now() - timedelta(seconds=heartbeat_age)
+        return BulkOperation.objects.create(
+            action='test', status='running', started_at=heartbeat_at, heartbeat_at=heartbeat_at, **fields
+        )
+    
+    def test_fails_operation_whose_heartbeat_timed_out(self):
+        stale = self.make_operation(600, task_id='dead-task', worker_hostname='worker-1')
+        alive = self.make_operation(10, worker_hostname='worker-2')
+        
+        result, revoke = self.reap()
+        self.assertEqual(result['failed_operations'], [stale.id])
+        revoke.assert_called_once_with('dead-task', terminate=True)
+        
+        stale.refresh_from_db()
+        self.assertEqual(stale.status, 'failed')
+        self.assertIsNotNone(stale.completed_at)
+        self.assertIn('worker-1', stale.error_message)
+        alive.refresh_from_db()
+        self.assertEqual(alive.status, 'running')
+    
+    def test_fails_operation_whose_worker_stopped_answering(self):
+        gone = self.make_operation(90, worker_hostname='worker-1')
+        busy = self.make_operation(90, worker_hostname='worker-2')
+        
+        result, _ = self.reap(live_workers={'worker-2'})
+        self.assertEqual(result['failed_operations'], [gone.id])
+        busy.refresh_from_db()
+        self.assertEqual(busy.status, 'running')
+
+
+class BulkOperationTests(TestCase):
+    def setUp(self):
+        self.servers = {
+            name: SQLServer.objects.create(name=name, server_address=name, username='u', password='p',
+                                           databases='[]', is_active=name != 'retired')
+            for name in ('alpha', 'bravo', 'charlie', 'retired')
+        }
+    
+    def test_failure_on_one_server_does_not_stop_the_others(self):
+        def check(server, operation):
+            if server.name == 'bravo':
+                raise ConnectionError('login timeout')
+            if server.name == 'charlie':
+                return False, 'Database offline', {}
+            return True, 'Connection successful', {}
+        
+        operation = BulkOperation.objects.create(action='test', concurrency=2)
+        with mock.patch.dict(BULK_ACTIONS, {'test': check}):
+            run_bulk_operation(operation)
+        
+        operation.refresh_from_db()
+        self.assertEqual(operation.status, 'completed')
+        self.assertIsNotNone(operation.completed_at)
+        self.assertEqual((operation.total_servers, operation.processed_servers, operation.failed_servers), (3, 3, 2))
+        
+        results = {result.server.name: result for result in operation.results.all()}
+        self.assertEqual(set(results), {'alpha', 'bravo', 'charlie'})
+        self.assertEqual(operation.processed_servers, len(results))
+        self.assertEqual(operation.failed_servers, sum(not result.success for result in results.values()))
+        self.assertEqual(results['bravo'].message, 'login timeout')
+        self.assertEqual(results['charlie'].message, 'Database offline')
+        self.assertTrue(results['alpha'].success)
+    
+    def test_status_returns_results_after_the_given_id(self):
+        operation = BulkOperation.objects.create(action='test', status='running', total_servers=3, processed_servers=2)
+        first, second = [
+            BulkOperationResult.objects.create(operation=operation, server=self.servers[name], success=True, message='ok')
+            for name in ('alpha', 'bravo')
+        ]
+        url = reverse('bulk_operation_status', args=[operation.id])
+        
+        data = self.client.get(url).json()
+        self.assertEqual([result['id'] for result in data['results']], [first.id, second.id])
+        self.assertEqual((data['processed'], data['percent']), (2, 66))
+        
+        data = self.client.get(url, {'after': first.id}).json()
+        self.assertEqual([result['server'] for result in data['results']], ['bravo'])
+        self.assertEqual(self.client.get(url, {'after': second.id}).json()['results'], [])
+        self.assertEqual(len(self.client.get(url, {'after': 'x'}).json()['results']), 2)
+    
+    def test_start(self):
+        url = reverse('bulk_operation_start')
+        response = self.client.post(url, {'action': 'drop_everything'})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(BulkOperation.objects.exists())
+        
+        with mock.patch('backup_app.views.bulk_operation_task') as task:
+            task.delay.return_value = mock.Mock(id='bulk-task')
+            response = self.client.post(url, {'action': 'test'})
+        operation = BulkOperation.objects.get()
+        self.assertRedirects(response, reverse('bulk_operation_detail', args=[operation.id]), fetch_redirect_response=False)
+        task.delay.assert_called_once_with(operation.id)
+        self.assertEqual((operation.task_id, operation.total_servers), ('bulk-task', 3))
+
+
+class TaskStatusViewTests(SimpleTestCase):
+    def poll(self, task_id):
+        return self.client.get(reverse('task_status', args=[task_id]))
+    
+    def test_rejects_unsigned_task_ids(self):
+        with mock.patch('backup_app.views.AsyncResult') as async_result:
+            response = self.poll('0b9a3f0e-backup-task')
+        self.assertEqual(response.status_code, 404)
+        async_result.assert_not_called()
+    
+    @mock.patch('backup_app.views.AsyncResult')
+    def test_reports_results(self, async_result):
+        token = signing.dumps('abc', salt=TASK_STATUS_SALT)
+        result = async_result.return_value
+        result.ready.return_value = False
+        self.assertEqual(self.poll(token).json(), {'pending': True, 'task_id': token})
+        async_result.assert_called_with('abc')
+        
+        result.ready.return_value = True
+        result.failed.return_value = False
+        result.result = {'success': True, 'message': 'Connection successful'}
+        self.assertEqual(self.poll(token).json(), result.result)
+        
+        result.result = 'Backup completed: /backups/srv/db'
+        self.assertEqual(self.poll(token).json(), {'success': False, 'message': 'Unexpected task result'})
+
+
+class DatabaseCacheKeyTests(SimpleTestCase):
+    def test_key_depends_on_password(self):
+        config = {'server_address': 'sql', 'port': 1433, 'username': 'sa', 'password': 'right'}
+        key = database_cache_key(config)
+        self.assertEqual(key, database_cache_key(dict(config)))
+        self.assertNotEqual(key, database_cache_key({**config, 'password': 'wrong'}))
+        self.assertNotIn('right', key)
+
+
+class FakeClientError(Exception):
+    def __init__(self, code):
+        super().__init__(code)
+        self.response = {'Error': {'Code': code}}
+
+
+class FakeS3Client:
+    """Enough of the boto3 S3 client for S3Storage, keeping objects in memory.
+    
+    Parts can be made to fail, and upload_part sleeps briefly while
+    tracking how many parts are in flight at once. ``part_delays`` maps
+    part numbers to their own upload time.
+    """
+    
+    class exceptions:
+        ClientError = FakeClientError
+    
+    def __init__(self, upload_delay=0.0, fail_part=None, part_delays=None):
+        self.objects = {}
+        self.uploads = {}
+        self.part_sizes = {}
+        self.calls = []
+        self.upload_delay = upload_delay
+        self.part_delays = part_delays or {}
+        self.fail_part = fail_part
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+    
+    def put_object(self, Bucket, Key, Body):
+        self.calls.append('put_object')
+        self.objects[Key] = bytes(Body)
+    
+    def create_multipart_upload(self, Bucket, Key):
+        self.calls.append('create_multipart_upload')
+        upload_id = f'upload-{len(self.uploads) + 1}'
+        self.uploads[upload_id] = {}
+        return {'UploadId': upload_id}
+    
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        with self.lock:
+            self.calls.append('upload_part')
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            time.sleep(self.part_delays.get(PartNumber, self.upload_delay))
+            if PartNumber == self.fail_part:
+                raise FakeClientError('InternalError')
+            if UploadId not in self.uploads:
+                self.calls.append('upload_part_after_abort')
+                raise FakeClientError('NoSuchUpload')
+            self.uploads[UploadId][PartNumber] = bytes(Body)
+            self.part_sizes[PartNumber] = len(Body)
+            return {'ETag': f'etag-{PartNumber}'}
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+    
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        self.calls.append('complete_multipart_upload')
+        parts = self.uploads.pop(UploadId)
+        numbers = [part['PartNumber'] for part in MultipartUpload['Parts']]
+        self.objects[Key] = b''.join(parts[number] for number in numbers)
+    
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.calls.append('abort_multipart_upload')
+        self.uploads.pop(UploadId, None)
+    
+    def head_object(self, Bucket, Key):
+        if Key not in self.objects:
+            raise FakeClientError('404')
+        return {'ContentLength': len(self.objects[Key])}
+    
+    def get_object(self, Bucket, Key, Range):
+        data = self.objects[Key]
+        start, _, end = Range[len('bytes='):].partition('-')
+        if int(start) >= len(data):
+            raise FakeClientError('InvalidRange')
+        stop = int(end) + 1 if end else len(data)
+        return {'Body': io.BytesIO(data[int(start):stop])}
+
+
+class DiscardOnFailureTests(StorageTestCase):
+    def test_failed_spilled_table_leaves_no_file(self):
+        class FailingCursor(FakeTableCursor):
+            fetches = 0
+            
+            def fetchmany(self, size):
+                FailingCursor.fetches += 1
+                if FailingCursor.fetches > 1:
+                    raise RuntimeError("connection reset")
+                return super().fetchmany(size)
+        
+        class FailingBackup(StubbedStreamBackup):
+            def connect(self, database_name='master', **kwargs):
+                return FakeConnection(FailingCursor(self.tables))
+        
+        engine = FailingBackup({('dbo', 'big'): make_table(1500)}, self.storage)
+        segments = SegmentWriter(self.storage, 'backup', 1024)
+        with override_settings(BACKUP_PACK_THRESHOLD=200):
+            with self.assertRaises(RuntimeError):
+                engine.pack_table_data('db', 'dbo', 'big', 'backup/dbo_big.json.gz', segments, block_rows=100)
+        self.assertFalse(self.storage.exists('backup/dbo_big.json.gz'))
+    
+    def test_spill_buffer_discards_s3_upload(self):
+        client = FakeS3Client()
+        storage = S3Storage('bucket', client=client, part_size=5 * 1024 * 1024, concurrency=2)
+        buffer = SpillBuffer(storage, 'backup/dbo_big.json.gz', threshold=1024)
+        buffer.write(b'x' * (6 * 1024 * 1024))
+        buffer.discard()
+        buffer.close()
+        
+        self.assertIn('abort_multipart_upload', client.calls)
+        self.assertNotIn('complete_multipart_upload', client.calls)
+        self.assertEqual(client.objects, {})
+
+
+class S3StorageTests(SimpleTestCase):
+    def write(self, client, chunks, part_size=10, concurrency=2):
+        writer = S3MultipartWriter(client, 'bucket', 'backup/table.json.gz', part_size, concurrency)
+        with writer:
+            for chunk in chunks:
+                writer.write(chunk)
+        return writer
+    
+    def test_splits_into_parts_with_bounded_concurrency(self):
+        client = FakeS3Client(upload_delay=0.01)
+        data = bytes(range(256)) * 2
+        self.write(client, [data[i:i + 7] for i in range(0, len(data), 7)], concurrency=3)
+        
+        self.assertEqual(client.objects['backup/table.json.gz'], data)
+        self.assertEqual(client.calls.count('upload_part'), 52)
+        self.assertLessEqual(client.max_in_flight, 3)
+        self.assertGreater(client.max_in_flight, 1)
+        self.assertEqual(client.calls[-1], 'complete_multipart_upload')
+    
+    def test_small_files_use_put_object(self):
+        client = FakeS3Client()
+        self.write(client, [b'12345'])
+        self.assertEqual(client.calls, ['put_object'])
+        self.assertEqual(client.objects['backup/table.json.gz'], b'12345')
+    
+    def test_aborts_when_a_part_fails(self):
+        client = FakeS3Client(fail_part=2)
+        with self.assertRaises(FakeClientError):
+            self.write(client, [b'x' * 10] * 5)
+        self.assertIn('abort_multipart_upload', client.calls)
+        self.assertNotIn('complete_multipart_upload', client.calls)
+        self.assertEqual(client.objects, {})
+        self.assertEqual(client.uploads, {})
+    
+    def test_ranged_reads(self):
+        client = FakeS3Client()
+        storage = S3Storage('bucket', prefix='/backups/', client=client)
+        storage.write_bytes('srv/db/data.bin', b'0123456789')
+        
+        self.assertEqual(storage.location('srv/db/data.bin'), 's3://bucket/backups/srv/db/data.bin')
+        with storage.open_read('srv/db/data.bin') as f:
+            self.assertEqual(f.read(3), b'012')
+            f.seek(8)
+            self.assertEqual(f.read(5), b'89')
+            self.assertEqual(f.read(5), b'')
+            f.seek(10)
+            self.assertEqual(f.read(1), b'')
+            f.seek(-4, io.SEEK_END)
+            self.assertEqual(f.read(), b'6789')
+        self.assertEqual(storage.read_bytes('srv/db/data.bin'), b'0123456789')
+        
+        with self.assertRaises(FileNotFoundError):
+            storage.open_read('srv/db/missing.bin')
+        self.assertFalse(storage.exists('srv/db/missing.bin'))
+    
+    def test_minimum_part_size(self):
+        with self.assertRaises(ImproperlyConfigured):
+            S3Storage('bucket', client=FakeS3Client(), part_size=1024 * 1024)
+
+
+class S3MultipartFailureTests(SimpleTestCase):
+    def test_stops_writing_at_first_failed_part(self):
+        client = FakeS3Client(upload_delay=0.01, fail_part=1)
+        writer = S3MultipartWriter(client, 'bucket', 'key', part_size=10, concurrency=1)
+        with self.assertRaises(FakeClientError):
+            with writer:
+                for _ in range(1000):
+                    writer.write(b'x' * 10)
+        self.assertLessEqual(client.calls.count('upload_part'), 2)
+        self.assertIn('abort_multipart_upload', client.calls)
+    
+    def test_close_aborts_only_after_parts_in_flight_finish(self):
+        client = FakeS3Client(fail_part=1, part_delays={1: 0.05, 2: 0.3})
+        writer = S3MultipartWriter(client, 'bucket', 'key', part_size=10, concurrency=2)
+        writer.write(b'x' * 20)
+        with self.assertRaises(FakeClientError):
+            writer.close()
+        self.assertEqual(client.calls[-1], 'abort_multipart_upload')
+        self.assertNotIn('upload_part_after_abort', client.calls)
+    
+    @mock.patch('backup_app.storage.PART_SIZE_DOUBLING_INTERVAL', 2)
+    @mock.patch('backup_app.storage.MAX_PARTS', 6)
+    def test_part_size_grows_to_stay_within_the_part_limit(self):
+        client = FakeS3Client()
+        data = bytes(range(140))
+        with S3MultipartWriter(client, 'bucket', 'key', part_size=10, concurrency=2) as writer:
+            writer.write(data)
+        self.assertEqual(client.objects['key'], data)
+        self.assertEqual([client.part_sizes[number] for number in range(1, 7)], [10, 10, 20, 20, 40, 40])
+        
+        with self.assertRaisesRegex(OSError, 'more than 6 parts'):
+            with S3MultipartWriter(FakeS3Client(), 'bucket', 'key', part_size=10, concurrency=2) as writer:
+                writer.write(data + b'x' * 80)
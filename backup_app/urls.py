@@ -9,7 +9,15 @@ urlpatterns = [
     path('servers/<int:server_id>/backup/', views.start_backup, name='start_backup'),
     path('test-connection/', views.test_connection, name='test_connection'),
     path('fetch-databases/', views.fetch_databases, name='fetch_databases'), 
+    path('tasks/<str:task_id>/', views.task_status, name='task_status'),
     path('jobs/', views.job_list, name='job_list'),
     path('jobs/<int:pk>/', views.job_detail, name='job_detail'),
+    path('jobs/<int:pk>/preview/', views.job_table_preview, name='job_table_preview'),
+    path('jobs/<int:pk>/export/', views.job_table_export, name='job_table_export'),
+    path('jobs/<int:pk>/compare/', views.job_compare, name='job_compare'),
     path('jobs/<int:job_id>/cancel/', views.cancel_job, name='cancel_job'),
+    path('bulk/', views.bulk_operation_list, name='bulk_operation_list'),
+    path('bulk/start/', views.bulk_operation_start, name='bulk_operation_start'),
+    path('bulk/<int:pk>/', views.bulk_operation_detail, name='bulk_operation_detail'),
+    path('bulk/<int:pk>/status/', views.bulk_operation_status, name='bulk_operation_status'),
 ]
\ No newline at end of file
@@ -1,14 +1,33 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
-from django.http import JsonResponse
+from django.http import JsonResponse, Http404, HttpResponseBadRequest, StreamingHttpResponse
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
 from django.views.decorators.http import require_http_methods
 from django.core.paginator import Paginator
-from .models import SQLServer, BackupJob, BackupSchedule
+from django.db.models import Count, Min
+from .models import SQLServer, BackupJob, BackupSchedule, BulkOperation
 from .forms import SQLServerForm, TestConnectionForm
-from .tasks import backup_server_databases, backup_database_task
-from .backup_engine import MSSQLStreamBackup
+from .tasks import (
+    backup_server_databases, backup_database_task, test_connection_task,
+    bulk_operation_task, fetch_databases_task,
+)
+from .backup_reader import BackupReader
+from .backup_diff import compare_backups
+from .discovery import get_cached_databases, get_servers_health
+from .scheduling import predict_queue_eta
+from .bulk import get_bulk_concurrency, get_bulk_servers
+from celery.result import AsyncResult
+import csv
+import io
 import json
+import uuid
 from django.utils import timezone
+from django.utils.http import content_disposition_header
+
+TASK_STATUS_SALT = 'backup_app.task_status'
+TASK_STATUS_MAX_AGE = 60 * 60  # Seconds a polling token stays valid
 
 def dashboard(request):
     """Main dashboard view"""
@@ -29,10 +48,19 @@ def dashboard(request):
         ).count(),
     }
     
+    health = get_servers_health(servers)
+    for server in servers:
+        server.health = health.get(server.id)
+    
     return render(request, 'backup_app/dashboard.html', {
         'servers': servers,
         'recent_jobs': recent_jobs,
         'stats': stats,
+        'queue_eta': predict_queue_eta(),
+        'worker_load': BackupJob.objects.filter(status='running')
+            .values('worker_hostname')
+            .annotate(running=Count('id'), oldest_heartbeat=Min('heartbeat_at'))
+            .order_by('worker_hostname'),
     })
 
 def server_list(request):
@@ -77,26 +105,122 @@ def server_edit(request, pk):
 
 @require_http_methods(["POST"])
 def test_connection(request):
-    """Test database connection via AJAX"""
+    """Queue a connection test; the browser polls task_status for the result"""
     server_id = request.POST.get('server_id')
     server = get_object_or_404(SQLServer, pk=server_id)
     
-    server_config = {
-        'name': server.name,
-        'server_address': server.server_address,
-        'port': server.port,
-        'username': server.username,
-        'password': server.password,
-    }
+    task = test_connection_task.delay(server.id)
+    return pending_task_response(task)
+
+@require_http_methods(["POST"])
+def bulk_operation_start(request):
+    """Start a fleet-wide operation in the background and show its progress"""
+    action = request.POST.get('action')
+    if action not in dict(BulkOperation.ACTION_CHOICES):
+        return HttpResponseBadRequest("Unknown bulk action")
+    
+    operation = BulkOperation.objects.create(
+        action=action,
+        concurrency=get_bulk_concurrency(),
+        total_servers=get_bulk_servers().count(),
+    )
+    try:
+        task = bulk_operation_task.delay(operation.id)
+        operation.task_id = task.id
+        operation.save(update_fields=['task_id'])
+    except Exception as e:
+        operation.status = 'failed'
+        operation.error_message = str(e)
+        operation.save(update_fields=['status', 'error_message'])
+        messages.error(request, f'Failed to start {operation.get_action_display().lower()}: {str(e)}')
+        return redirect('dashboard')
+    
+    return redirect('bulk_operation_detail', pk=operation.id)
+
+def bulk_operation_list(request):
+    """List fleet-wide operations with pagination"""
+    paginator = Paginator(BulkOperation.objects.all(), 25)
+    page_obj = paginator.get_page(request.GET.get('page'))
+    
+    return render(request, 'backup_app/bulk_operation_list.html', {
+        'page_obj': page_obj,
+        'actions': BulkOperation.ACTION_CHOICES,
+    })
+
+def get_bulk_job_counts(operation):
+    """Status counts of the backup jobs queued by a bulk backup"""
+    counts = operation.backup_jobs.values('status').annotate(count=Count('id'))
+    return {row['status']: row['count'] for row in counts}
+
+def bulk_operation_detail(request, pk):
+    """Consolidated progress and per-server results of a bulk operation"""
+    operation = get_object_or_404(BulkOperation, pk=pk)
+    
+    return render(request, 'backup_app/bulk_operation_detail.html', {
+        'operation': operation,
+        'results': operation.results.select_related('server'),
+        'job_counts': get_bulk_job_counts(operation) if operation.action == 'backup' else None,
+    })
+
+def bulk_operation_status(request, pk):
+    """Poll a bulk operation's progress; returns results recorded after ?after=<result id>"""
+    operation = get_object_or_404(BulkOperation, pk=pk)
+    try:
+        after = int(request.GET.get('after', 0))
+    except ValueError:
+        after = 0
     
-    backup_engine = MSSQLStreamBackup(server_config)
-    success, message = backup_engine.test_connection()
+    results = operation.results.filter(pk__gt=after).select_related('server').order_by('pk')
+    return JsonResponse({
+        'status': operation.status,
+        'status_display': operation.get_status_display(),
+        'total': operation.total_servers,
+        'processed': operation.processed_servers,
+        'succeeded': operation.succeeded_servers,
+        'failed': operation.failed_servers,
+        'percent': operation.percent_complete,
+        'error_message': operation.error_message,
+        'job_counts': get_bulk_job_counts(operation) if operation.action == 'backup' else None,
+        'results': [
+            {
+                'id': result.id,
+                'server': result.server.name,
+                'success': result.success,
+                'message': result.message,
+                'finished_at': result.finished_at.isoformat(),
+            }
+            for result in results
+        ],
+    })
+
+def pending_task_response(task):
+    """Tell the browser to poll task_status for a task's result.
     
+    The task id is signed, so task_status only ever reports on tasks that
+    one of these views started.
+    """
     return JsonResponse({
-        'success': success,
-        'message': message
+        'pending': True,
+        'task_id': signing.dumps(task.id, salt=TASK_STATUS_SALT),
     })
 
+def task_status(request, task_id):
+    """Poll the result of a background task started by an AJAX view"""
+    try:
+        celery_task_id = signing.loads(task_id, salt=TASK_STATUS_SALT, max_age=TASK_STATUS_MAX_AGE)
+    except signing.BadSignature:
+        raise Http404("Unknown task")
+    
+    result = AsyncResult(celery_task_id)
+    if not result.ready():
+        return JsonResponse({'pending': True, 'task_id': task_id})
+    
+    if result.failed():
+        return JsonResponse({'success': False, 'message': str(result.result)})
+    if not isinstance(result.result, dict):
+        return JsonResponse({'success': False, 'message': 'Unexpected task result'})
+    return JsonResponse(result.result)
+
 @require_http_methods(["POST"])
 def start_backup(request, server_id):
     """Start backup for all databases on a server"""
@@ -138,10 +262,182 @@ def job_list(request):
         'server_filter': server_filter,
     })
 
+def get_job_reader(job):
+    """Return a BackupReader for a completed streaming backup, or None"""
+    if job.status != 'completed' or not job.backup_path:
+        return None
+    reader = BackupReader(job.backup_path)
+    if not reader.exists():
+        return None
+    return reader
+
 def job_detail(request, pk):
     """View job details"""
     job = get_object_or_404(BackupJob, pk=pk)
-    return render(request, 'backup_app/job_detail.html', {'job': job})
+    reader = get_job_reader(job)
+    
+    manifest = reader.get_manifest() if reader else {}
+    
+    return render(request, 'backup_app/job_detail.html', {
+        'job': job,
+        'backup_tables': manifest.get('tables', []),
+        'compression_stats': manifest.get('compression_stats'),
+        'compression_dictionary': manifest.get('compression_dictionary'),
+        'comparable_jobs': get_comparable_jobs(job)[:10] if reader else [],
+    })
+
+def get_comparable_jobs(job):
+    """Other completed backups of the same database, newest first"""
+    return BackupJob.objects.filter(
+        server=job.server,
+        database_name=job.database_name,
+        status='completed',
+    ).exclude(pk=job.pk).exclude(backup_path='').order_by('-completed_at')
+
+def job_compare(request, pk):
+    """Compare a backup with another backup of the same database.
+    
+    Defaults to the backup completed just before this one. Only hashes are
+    compared, so this reads manifests and indexes but never table data;
+    tables that would have to be decoded are listed as skipped and left to
+    the compare_backups management command.
+    """
+    job = get_object_or_404(BackupJob, pk=pk)
+    other_id = request.GET.get('other')
+    if other_id:
+        other = get_object_or_404(get_comparable_jobs(job), pk=other_id)
+    else:
+        other = get_comparable_jobs(job).filter(completed_at__lt=job.completed_at).first() if job.completed_at else None
+        if other is None:
+            raise Http404("No earlier backup of this database to compare with")
+    
+    readers = {candidate.pk: get_job_reader(candidate) for candidate in (job, other)}
+    if None in readers.values():
+        raise Http404("Backup data is not available for both jobs")
+    
+    old_job, new_job = sorted([job, other], key=lambda candidate: (candidate.completed_at, candidate.pk))
+    diff = compare_backups(readers[old_job.pk], readers[new_job.pk], decode=False)
+    changed = [result for result in diff['tables'] if result['status'] != 'unchanged']
+    
+    return render(request, 'backup_app/job_compare.html', {
+        'job': job,
+        'old_job': old_job,
+        'new_job': new_job,
+        'summary': diff['summary'],
+        'changed_tables': changed,
+    })
+
+def job_table_preview(request, pk):
+    """Show a page of rows from one table of a backup"""
+    job = get_object_or_404(BackupJob, pk=pk)
+    reader = get_job_reader(job)
+    if reader is None:
+        raise Http404("Backup data is not available for this job")
+    
+    schema_name = request.GET.get('schema', '')
+    table_name = request.GET.get('table', '')
+    try:
+        index = reader.get_table_index(schema_name, table_name)
+    except KeyError:
+        raise Http404(f"Table {schema_name}.{table_name} not found in backup")
+    
+    # Counting a legacy single-stream table means reading all of it, so
+    # those are paged through without a total
+    row_count = reader.get_row_count(schema_name, table_name) if index is not None else None
+    
+    page_size = getattr(settings, 'TABLE_PREVIEW_ROWS', 100)
+    try:
+        start = max(int(request.GET.get('start', 0)), 0)
+    except ValueError:
+        start = 0
+    
+    columns = reader.get_columns(schema_name, table_name)
+    # One extra row tells us whether there is a next page
+    rows = reader.read_rows(schema_name, table_name, start, page_size + 1)
+    has_next = len(rows) > page_size
+    rows = rows[:page_size]
+    
+    return render(request, 'backup_app/table_preview.html', {
+        'job': job,
+        'schema_name': schema_name,
+        'table_name': table_name,
+        'columns': columns,
+        'rows': [[row.get(column) for column in columns] for row in rows],
+        'row_count': row_count,
+        'start': start,
+        'end': start + len(rows),
+        'previous_start': max(start - page_size, 0) if start > 0 else None,
+        'next_start': start + page_size if has_next else None,
+    })
+
+def iter_export_chunks(rows, columns, export_format, chunk_size=64 * 1024):
+    """Encode rows as CSV or NDJSON, yielding output in chunks of roughly chunk_size bytes"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer) if export_format == 'csv' else None
+    
+    if writer:
+        writer.writerow(columns)
+    
+    for row in rows:
+        if writer:
+            writer.writerow([row.get(column) for column in columns])
+        else:
+            buffer.write(json.dumps({column: row.get(column) for column in columns}))
+            buffer.write('\n')
+        
+        if buffer.tell() >= chunk_size:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+def job_table_export(request, pk):
+    """Stream one table of a backup as CSV or NDJSON"""
+    job = get_object_or_404(BackupJob, pk=pk)
+    reader = get_job_reader(job)
+    if reader is None:
+        raise Http404("Backup data is not available for this job")
+    
+    schema_name = request.GET.get('schema', '')
+    table_name = request.GET.get('table', '')
+    try:
+        all_columns = reader.get_columns(schema_name, table_name)
+    except KeyError:
+        raise Http404(f"Table {schema_name}.{table_name} not found in backup")
+    
+    export_format = request.GET.get('format', 'csv')
+    if export_format not in ('csv', 'ndjson'):
+        return HttpResponseBadRequest("format must be 'csv' or 'ndjson'")
+    
+    # One parameter per column: SQL Server column names may contain commas
+    columns = [column for column in request.GET.getlist('columns') if column]
+    unknown = [column for column in columns if column not in all_columns]
+    if unknown:
+        return HttpResponseBadRequest(f"Unknown columns: {', '.join(unknown)}")
+    columns = columns or all_columns
+    
+    limit = request.GET.get('limit')
+    try:
+        limit = int(limit) if limit else None
+    except ValueError:
+        return HttpResponseBadRequest("limit must be an integer")
+    if limit is not None and limit < 0:
+        return HttpResponseBadRequest("limit must not be negative")
+    
+    rows = reader.iter_rows(schema_name, table_name, 0, limit)
+    content_type = 'text/csv' if export_format == 'csv' else 'application/x-ndjson'
+    response = StreamingHttpResponse(
+        iter_export_chunks(rows, columns, export_format),
+        content_type=f'{content_type}; charset=utf-8',
+    )
+    file_name = f"{job.database_name}_{schema_name}_{table_name}.{export_format}"
+    response['Content-Disposition'] = content_disposition_header(True, file_name)
+    # The length is unknown up front, so the response is sent chunked;
+    # stop proxies from buffering the whole table before forwarding it.
+    response['X-Accel-Buffering'] = 'no'
+    return response
 
 @require_http_methods(["POST"])
 def cancel_job(request, job_id):
@@ -152,8 +448,9 @@ def cancel_job(request, job_id):
         from celery import current_app
         current_app.control.revoke(job.task_id, terminate=True)
         job.status = 'failed'
+        job.completed_at = timezone.now()
         job.error_message = 'Cancelled by user'
-        job.save()
+        job.save(update_fields=['status', 'completed_at', 'error_message'])
         messages.success(request, 'Job cancelled successfully')
     else:
         messages.error(request, 'Job cannot be cancelled')
@@ -162,11 +459,12 @@ def cancel_job(request, job_id):
 
 @require_http_methods(["POST"])
 def fetch_databases(request):
-    """Fetch databases from server via AJAX"""
+    """Fetch databases from server via AJAX, from cache when possible"""
     server_address = request.POST.get('server_address')
     port = request.POST.get('port')
     username = request.POST.get('username')
     password = request.POST.get('password')
+    refresh = request.POST.get('refresh') == '1'
     
     if not all([server_address, port, username, password]):
         return JsonResponse({
@@ -182,17 +480,18 @@ def fetch_databases(request):
         'password': password,
     }
     
-    try:
-        backup_engine = MSSQLStreamBackup(server_config)
-        databases = backup_engine.get_all_databases()
-        
-        return JsonResponse({
-            'success': True,
-            'databases': databases,
-            'message': f'Found {len(databases)} databases'
-        })
-    except Exception as e:
-        return JsonResponse({
-            'success': False,
-            'message': str(e)
-        })
\ No newline at end of file
+    if not refresh:
+        databases = get_cached_databases(server_config)
+        if databases is not None:
+            return JsonResponse({
+                'success': True,
+                'databases': databases,
+                'cached': True,
+                'message': f'Found {len(databases)} databases (cached)'
+            })
+    
+    # Keep the credentials out of the task arguments; the task picks them up from the cache
+    request_key = f'fetch_databases:{uuid.uuid4().hex}'
+    cache.set(request_key, server_config, 300)
+    task = fetch_databases_task.delay(request_key, refresh=refresh)
+    return pending_task_response(task)
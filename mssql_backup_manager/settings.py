@@ -55,9 +55,92 @@ CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'UTC'
 
+# Tasks the UI waits on (connection tests, database discovery, bulk operations) get their
+# own queue so they never sit behind backups in a busy worker's slots.
+CELERY_TASK_ROUTES = {
+    'backup_app.tasks.test_connection_task': {'queue': 'interactive'},
+    'backup_app.tasks.fetch_databases_task': {'queue': 'interactive'},
+    'backup_app.tasks.bulk_operation_task': {'queue': 'interactive'},
+}
+
+# Backup job routing. Jobs are estimated from the last BACKUP_HISTORY_SAMPLE completed
+# backups of the same database and routed to a small or large queue, each with its own
+# worker pool. Backup workers only consume backup queues; a separate worker serves the
+# interactive queue and the default 'celery' queue (dispatch and the job reaper), e.g.:
+#   celery -A mssql_backup_manager worker -Q interactive,celery -c 8
+#   celery -A mssql_backup_manager worker -Q backups_small -c 4
+#   celery -A mssql_backup_manager worker -Q backups_large -c 1
+BACKUP_SMALL_QUEUE = 'backups_small'
+BACKUP_LARGE_QUEUE = 'backups_large'
+BACKUP_LARGE_JOB_SECONDS = 30 * 60  # Estimated duration at which a job goes to the large queue
+BACKUP_LARGE_JOB_BYTES = 10 * 1024 ** 3  # Estimated backup size at which a job goes to the large queue
+BACKUP_DEFAULT_ESTIMATE_SECONDS = 300  # Estimate for databases with no backup history
+BACKUP_HISTORY_SAMPLE = 5
+BACKUP_DISPATCH_ORDER = 'shortest_first'  # or 'longest_first'
+BACKUP_QUEUE_WORKERS = {  # Worker concurrency per queue, used for the dashboard ETA
+    'backups_small': 4,
+    'backups_large': 1,
+}
+
+# Running jobs and bulk operations stamp a heartbeat; the reaper (run by celery beat) requeues
+# or fails those whose worker has stopped, so crashed workers don't leave them 'running' forever.
+BACKUP_HEARTBEAT_INTERVAL = 30  # Seconds between heartbeats
+BACKUP_HEARTBEAT_TIMEOUT = 150  # Heartbeat age after which a running job is considered dead
+BACKUP_REAP_REQUEUE = True  # Requeue dead jobs instead of failing them straight away
+BACKUP_MAX_ATTEMPTS = 3  # Runs per job before the reaper gives up and marks it failed
+CELERY_BEAT_SCHEDULE = {
+    'reap-stale-backup-jobs': {
+        'task': 'backup_app.tasks.reap_stale_jobs',
+        'schedule': 60.0,
+    },
+}
+
+# Cache (shared by web and Celery workers for database lists and server health)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': 'redis://localhost:6379/1',
+    }
+}
+DATABASE_LIST_CACHE_TTL = 300  # Seconds a server's database list is reused before re-querying sys.databases
+SERVER_HEALTH_CACHE_TTL = 600  # Seconds a connection test result is shown on the dashboard
+BULK_OPERATION_CONCURRENCY = 16  # Servers handled in parallel by fleet-wide bulk operations
+
 # Backup Settings
 BACKUP_ROOT = os.path.join(BASE_DIR, 'backups')
 os.makedirs(BACKUP_ROOT, exist_ok=True)
+NATIVE_BACKUP_POLL_INTERVAL = 5  # Seconds between percent_complete polls
+BACKUP_BLOCK_ROWS = 10000  # Rows per independently compressed block in table files
+BACKUP_LAYOUT = 'packed'  # 'packed' stores small tables in shared segment files, 'dedicated' gives every table its own file
+BACKUP_PACK_THRESHOLD = 1024 * 1024  # Tables compressing to more than this many bytes get a dedicated file
+BACKUP_SEGMENT_SIZE = 256 * 1024 * 1024  # Maximum size of a shared segment file
+BACKUP_ZSTD_DICTIONARY = False  # Train a zstd dictionary per database from its previous backup (requires zstandard)
+BACKUP_ZSTD_DICT_SIZE = 110 * 1024  # Dictionary size in bytes
+BACKUP_ZSTD_LEVEL = 3
+BACKUP_COMPARE_CONCURRENCY = 8  # Tables compared in parallel when diffing two backups
+
+# Where streaming backups are stored. 'local' writes under BACKUP_ROOT; 's3' uploads
+# to an S3-compatible bucket (requires boto3), e.g.:
+# BACKUP_STORAGE = {
+#     'BACKEND': 's3',
+#     'OPTIONS': {
+#         'bucket': 'sql-backups',
+#         'prefix': 'mssql',
+#         'endpoint_url': 'http://minio.local:9000',  # omit for AWS S3
+#         'access_key': '...',
+#         'secret_key': '...',
+#         'part_size': 8 * 1024 * 1024,  # initial multipart part size, at least 5 MB
+#         'concurrency': 4,  # parts uploaded in parallel per file
+#     },
+# }
+# S3 allows at most 10,000 parts per file, so parts double in size every 1,000 parts
+# (up to S3's 5 GB maximum): with 8 MB parts a single table or segment file can grow to
+# S3's 5 TB object limit. Memory per file being written is up to concurrency x the current part size.
+BACKUP_STORAGE = {
+    'BACKEND': 'local',
+    'OPTIONS': {},
+}
+TABLE_PREVIEW_ROWS = 100  # Rows per page in the job detail table preview
 
 
 MIDDLEWARE = [